@@ -2,24 +2,53 @@
 import streamlit as st
 
 # 必要なライブラリをインポート
-from pixivpy3 import AppPixivAPI
+# pixivpy3・matplotlibは使う関数の中で読み込む（並列再分析のワーカープロセスはspawn時に
+# このスクリプトを__mp_main__として再実行するため、トップレベルの処理を軽く保つ）
 from collections import Counter
+import json
+import os
+import sqlite3
+import struct
 import time
-import matplotlib.pyplot as plt
-import matplotlib
 
-# 日本語フォント設定
-import platform
-system = platform.system()
+# 集計パイプライン（並列再分析のワーカーと共通）
+from pixiv_tag_pipeline import (
+    PARALLEL_MIN_ILLUSTS,
+    TAG_SEARCH_MODES,
+    collect_illust_tags,
+    exclude_search_tags,
+    is_ai_tagged,
+    parallel_count_tags
+)
+
+# 高速JSONパーサー（未インストール時は標準のjsonを使用）
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-if system == "Windows":
-    matplotlib.rcParams['font.family'] = ['MS Gothic', 'Yu Gothic', 'Meiryo', 'DejaVu Sans']
-elif system == "Darwin":  # macOS
-    matplotlib.rcParams['font.family'] = ['Hiragino Sans', 'Yu Gothic', 'DejaVu Sans']
-else:  # Linux
-    matplotlib.rcParams['font.family'] = ['Noto Sans CJK JP', 'DejaVu Sans']
+# ローカルデータの保存先（環境変数で変更可能）
+DATA_DIR = os.environ.get(
+    "PIXIV_ANALYZER_DATA_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "pixiv_data")
+)
 
-matplotlib.font_manager._load_fontmanager(try_read_cache=False)
+# 日本語フォント設定（GUIの描画時のみ、main()から呼び出す）
+def setup_japanese_font():
+    import platform
+    import matplotlib
+    import matplotlib.font_manager
+    
+    system = platform.system()
+    
+    if system == "Windows":
+        matplotlib.rcParams['font.family'] = ['MS Gothic', 'Yu Gothic', 'Meiryo', 'DejaVu Sans']
+    elif system == "Darwin":  # macOS
+        matplotlib.rcParams['font.family'] = ['Hiragino Sans', 'Yu Gothic', 'DejaVu Sans']
+    else:  # Linux
+        matplotlib.rcParams['font.family'] = ['Noto Sans CJK JP', 'DejaVu Sans']
+    
+    matplotlib.font_manager._load_fontmanager(try_read_cache=False)
 
 # 状態初期化
 def get_pixiv_api():
@@ -33,6 +62,8 @@ def pixiv_login(refresh_token):
         st.error("refresh_tokenを入力してください。")
         return
     
+    from pixivpy3 import AppPixivAPI
+    
     api = AppPixivAPI()
     try:
         with st.spinner("Pixivにログイン中..."):
@@ -46,82 +77,9 @@ def pixiv_login(refresh_token):
         st.error(f"❌ Pixivログインに失敗しました: {str(e)}")
         st.info("refresh_tokenが正しいか確認してください。")
 
-# 英語タグ判定と除外機能
-def is_english_tag(tag):
-    """タグが英語かどうかを判定"""
-    import re
-    
-    # 空文字や短すぎるタグは除外しない
-    if not tag or len(tag.strip()) < 2:
-        return False
-    
-    tag = tag.strip()
-    
-    # 日本語文字（ひらがな、カタカナ、漢字）が含まれていれば日本語タグとして扱う
-    japanese_chars = re.search(r'[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF]', tag)
-    if japanese_chars:
-        return False
-    
-    # 数字のみの場合は除外しない（年号など）
-    if tag.isdigit():
-        return False
-    
-    # 英語の文字が80%以上を占める場合は英語タグとして判定
-    english_chars = re.findall(r'[a-zA-Z]', tag)
-    total_meaningful_chars = re.findall(r'[a-zA-Z\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF]', tag)
-    
-    if len(total_meaningful_chars) == 0:
-        return False
-    
-    english_ratio = len(english_chars) / len(total_meaningful_chars)
-    return english_ratio >= 0.8
-
-def filter_tags_by_language(tags, exclude_english=True):
-    """言語設定に基づいてタグをフィルタリング"""
-    if not exclude_english:
-        return tags, 0
-    
-    filtered_tags = []
-    english_count = 0
-    
-    for tag in tags:
-        if is_english_tag(tag):
-            english_count += 1
-        else:
-            filtered_tags.append(tag)
-    
-    return filtered_tags, english_count
-
-# AI画像判定機能
-def is_ai_generated(illust):
-    """イラストがAI生成かどうかを判定（簡易版）"""
-    try:
-        # イラストの情報からAI関連の手がかりを探す
-        if hasattr(illust, 'illust_ai_type') and illust.illust_ai_type == 2:
-            return True
-        
-        # タグベースでの判定
-        if hasattr(illust, 'tags'):
-            ai_keywords = ['ai', 'ai生成', 'aiイラスト', 'stable diffusion', 'midjourney', 'novel ai', 'nai']
-            for tag in illust.tags:
-                if hasattr(tag, 'name'):
-                    tag_name = tag.name.lower()
-                    if any(keyword in tag_name for keyword in ai_keywords):
-                        return True
-                if hasattr(tag, 'translated_name') and tag.translated_name:
-                    tag_trans = tag.translated_name.lower()
-                    if any(keyword in tag_trans for keyword in ai_keywords):
-                        return True
-        
-        return False
-    except:
-        return False
-
 # リクエスト間隔を動的に調整する関数（ランダムジッター付き）
-def get_request_interval(max_illusts):
-    """取得件数に応じてリクエスト間隔を調整（最低1.5秒、ランダムジッター付き）"""
-    import random
-    
+def get_base_request_interval(max_illusts):
+    """取得件数に応じたジッター前の基本リクエスト間隔"""
     base_interval = 1.5  # 最低1.5秒
     if max_illusts <= 100:
         base_interval = 1.5  # 100件以下: 1.5秒
@@ -134,58 +92,376 @@ def get_request_interval(max_illusts):
     else:
         base_interval = 3.5  # 1000件: 3.5秒
     
+    return base_interval
+
+def get_request_interval(max_illusts):
+    """取得件数に応じてリクエスト間隔を調整（最低1.5秒、ランダムジッター付き）"""
+    import random
+    
+    base_interval = get_base_request_interval(max_illusts)
+    
     # ランダムジッター追加（±20%の範囲）
     jitter = random.uniform(-0.2, 0.2) * base_interval
     final_interval = max(1.5, base_interval + jitter)  # 最低1.5秒を保証
     
     return final_interval
 
+# クロール計画（該当率と実測時間からページ予算・ETAを算出）
+SEARCH_PAGE_SIZE = 30  # search_illustの1ページあたりの作品数
+MAX_SEARCH_PAGES = 166  # 検索offsetの上限（5000件）に相当するページ数
+PRIOR_LATENCY_SECONDS = 1.0  # 実測前に仮定する1リクエストあたりの通信時間
+PRIOR_MATCH_RATE_AI_EXCLUDED = 0.85  # AI除外時に実測前に仮定する該当率
+
+def format_duration(seconds):
+    """秒数を「X分Y秒」形式に整形"""
+    seconds = max(0, int(seconds))
+    return f"{seconds // 60}分{seconds % 60}秒"
+
+def estimate_page_seconds(max_illusts):
+    """実測前の1ページあたり所要時間の見積もり（待機＋通信＋追加休憩）"""
+    seconds = get_base_request_interval(max_illusts) + PRIOR_LATENCY_SECONDS
+    if max_illusts >= 500:
+        seconds += 4.0 / 10  # 10ページごとの追加休憩（平均4秒）を按分
+    return seconds
+
+class CrawlPlanner:
+    """該当率と1ページの実測所要時間を学習し、ページ予算とETAを更新する"""
+
+    def __init__(self, max_illusts, exclude_ai, max_requests=None, time_budget_seconds=None):
+        self.max_illusts = max_illusts
+        self.max_requests = min(max_requests or MAX_SEARCH_PAGES, MAX_SEARCH_PAGES)
+        self.time_budget_seconds = time_budget_seconds
+        prior_rate = PRIOR_MATCH_RATE_AI_EXCLUDED if exclude_ai else 1.0
+        self.prior_page_yield = SEARCH_PAGE_SIZE * prior_rate
+        self.prior_page_seconds = estimate_page_seconds(max_illusts)
+        self.pages = 0
+        self.fetched = 0
+        self.matched = 0
+        self.started_at = time.monotonic()
+
+    def elapsed(self):
+        """クロール開始からの実経過秒数"""
+        return time.monotonic() - self.started_at
+
+    def record_page(self, fetched, matched):
+        """1ページ処理後に取得数・該当数を記録"""
+        self.pages += 1
+        self.fetched += fetched
+        self.matched += matched
+
+    @property
+    def match_rate(self):
+        """実測の該当率（未取得時は事前値）"""
+        if not self.fetched:
+            return self.prior_page_yield / SEARCH_PAGE_SIZE
+        return self.matched / self.fetched
+
+    @property
+    def page_yield(self):
+        """1ページあたりの該当作品数（事前値を1ページ分混ぜて平滑化）"""
+        return max((self.matched + self.prior_page_yield) / (self.pages + 1), 0.5)
+
+    @property
+    def page_seconds(self):
+        """1ページあたりの実測所要時間（待機込み、未取得時は事前値）"""
+        if not self.pages:
+            return self.prior_page_seconds
+        return self.elapsed() / self.pages
+
+    def remaining_pages(self):
+        """目標件数に達するまでに必要な残りページ数の見積もり"""
+        import math
+        remaining = max(self.max_illusts - self.matched, 0)
+        return math.ceil(remaining / self.page_yield)
+
+    @property
+    def page_budget(self):
+        """現在の学習結果に基づくページ予算（リクエスト・時間予算で上限）"""
+        budget = min(self.max_requests, self.pages + self.remaining_pages() + 1)
+        if self.time_budget_seconds:
+            remaining_time = self.time_budget_seconds - self.elapsed()
+            budget = min(budget, self.pages + max(int(remaining_time // self.page_seconds), 0))
+        return budget
+
+    def eta_seconds(self):
+        """実測値に基づく残り時間の見積もり"""
+        return min(self.remaining_pages(), max(self.page_budget - self.pages, 0)) * self.page_seconds
+
+    def check_feasibility(self):
+        """クロール開始前に予算内で目標件数に届くかを判定し、(可否, 理由)を返す"""
+        pages_needed = self.remaining_pages()
+        if pages_needed > self.max_requests:
+            return False, (f"目標{self.max_illusts}件には約{pages_needed}ページ必要ですが、"
+                           f"リクエスト予算は{self.max_requests}ページです")
+        estimated_seconds = pages_needed * self.prior_page_seconds
+        if self.time_budget_seconds and estimated_seconds > self.time_budget_seconds:
+            return False, (f"目標{self.max_illusts}件には約{format_duration(estimated_seconds)}必要ですが、"
+                           f"時間予算は{format_duration(self.time_budget_seconds)}です")
+        return True, None
+
+# レート制限台帳（同じアカウントを使う全プロセス・全セッションでトークンバケットを共有）
+RATE_LEDGER_PATH = os.path.join(DATA_DIR, "rate_ledger.sqlite3")
+RATE_LIMIT_PER_SECOND = 1 / 1.5  # アカウント全体で許可するリクエスト数（最低間隔1.5秒に相当）
+RATE_LIMIT_BURST = 3  # 待たずに送れるリクエスト数（バケット容量）
+
+class RateLimitLedger:
+    """アカウントごとのトークンバケットとレート制限による停止時刻をSQLiteで共有する"""
+
+    def __init__(self, account, path=RATE_LEDGER_PATH, rate=RATE_LIMIT_PER_SECOND, burst=RATE_LIMIT_BURST):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.account = str(account or "default")
+        self.rate = rate
+        self.burst = burst
+        # トランザクションはBEGIN IMMEDIATEで明示的に開始する
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS buckets (
+                account TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                blocked_until REAL NOT NULL DEFAULT 0
+            )
+        """)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def _transaction(self, update):
+        """バケットを書き込みロック下で読み出し、update(tokens, updated_at, blocked_until, now)の結果で更新"""
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute(
+                "SELECT tokens, updated_at, blocked_until FROM buckets WHERE account = ?", (self.account,)
+            ).fetchone()
+            tokens, updated_at, blocked_until = row if row else (self.burst, now, 0.0)
+            tokens, updated_at, blocked_until, result = update(tokens, updated_at, blocked_until, now)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO buckets (account, tokens, updated_at, blocked_until) VALUES (?, ?, ?, ?)",
+                (self.account, tokens, updated_at, blocked_until)
+            )
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return result
+
+    def reserve(self):
+        """送信枠を1つ予約し、(送信までに待つ秒数, レート制限による停止中か)を返す"""
+        def update(tokens, updated_at, blocked_until, now):
+            if blocked_until > now:
+                # 停止中は予約も補充もせず、停止解除まで待たせる
+                return tokens, updated_at, blocked_until, (blocked_until - now, True)
+            tokens = min(self.burst, tokens + max(0.0, now - updated_at) * self.rate) - 1
+            # 残量が負なら、その分だけ先の時刻の枠を予約したことになる
+            return tokens, now, blocked_until, (max(0.0, -tokens / self.rate), False)
+
+        return self._transaction(update)
+
+    def blocked_until(self):
+        """レート制限による停止の解除時刻（停止していなければ0）"""
+        row = self.conn.execute(
+            "SELECT blocked_until FROM buckets WHERE account = ?", (self.account,)
+        ).fetchone()
+        return row[0] if row else 0.0
+
+    def acquire(self, notify=None):
+        """送信枠を確保できるまで待機"""
+        while True:
+            wait_seconds, blocked = self.reserve()
+            if blocked:
+                if notify:
+                    notify(f"⏳ レート制限により同じアカウントの全プロセスが停止中です。{wait_seconds:.1f}秒待機中...")
+                time.sleep(wait_seconds)
+                continue
+            if wait_seconds > 0:
+                time.sleep(wait_seconds)
+                # 予約した枠を待つ間に他のプロセスがレート制限を検出していたら、停止明けに取り直す
+                if self.blocked_until() > time.time():
+                    continue
+            return
+
+    def block(self, seconds):
+        """レート制限を検出したことを記録し、全参加プロセスの送信を指定秒数止める"""
+        def update(tokens, updated_at, blocked_until, now):
+            # 停止明けに一斉送信しないよう、バケットを空にして停止解除の時刻から補充を始める
+            blocked_until = max(blocked_until, now + seconds)
+            return 0.0, blocked_until, blocked_until, None
+
+        self._transaction(update)
+
+def open_rate_limit_ledger(api):
+    """ログイン中のアカウントの台帳を開く（開けない場合はNone、このプロセスの間隔制御のみで続行）"""
+    try:
+        return RateLimitLedger(getattr(api, 'user_id', None))
+    except (sqlite3.Error, OSError):
+        return None  # データフォルダーが作れない・書き込めない場合も含む
+
 # エラー時の指数バックオフ機能
-def exponential_backoff_request(api, request_func, max_retries=3, base_delay=2.0):
-    """指数バックオフとRetry-After尊重機能付きのAPIリクエスト"""
+def exponential_backoff_request(api, request_func, max_retries=3, base_delay=2.0, notify=None, ledger=None):
+    """指数バックオフとRetry-After尊重機能付きのAPIリクエスト（送信枠はアカウント共通の台帳から確保）"""
     import random
     import time
     from requests.exceptions import RequestException
     
-    for attempt in range(max_retries + 1):
-        try:
-            result = request_func()
-            return result, None  # 成功時はエラーなし
-            
-        except Exception as e:
-            error_message = str(e).lower()
-            
-            # 最後の試行の場合は諦める
-            if attempt == max_retries:
-                return None, f"最大リトライ回数({max_retries})に達しました: {str(e)}"
-            
-            # Retry-Afterヘッダーの確認（可能な場合）
-            retry_after = None
-            if hasattr(e, 'response') and e.response and hasattr(e.response, 'headers'):
-                retry_after = e.response.headers.get('Retry-After')
-            
-            # 待機時間の計算
-            if retry_after:
-                try:
-                    wait_time = float(retry_after)
-                    st.warning(f"⏳ サーバーからRetry-After指示: {wait_time}秒待機中...")
-                except:
+    # 通知先（GUIでは警告表示、事前取得デーモンではログ出力）
+    notify = notify or st.warning
+    
+    # 同じアカウントを使う他のプロセスと共有するレート制限台帳（渡されなければこの呼び出しの間だけ開く）
+    owns_ledger = ledger is None
+    if owns_ledger:
+        ledger = open_rate_limit_ledger(api)
+    
+    try:
+        for attempt in range(max_retries + 1):
+            try:
+                if ledger:
+                    ledger.acquire(notify)
+                result = request_func()
+                return result, None  # 成功時はエラーなし
+                
+            except Exception as e:
+                error_message = str(e).lower()
+                
+                # Retry-Afterヘッダーの確認（可能な場合）
+                # Responseは4xx/5xxで偽になるため、Noneかどうかで判定する
+                retry_after = None
+                if getattr(e, 'response', None) is not None and hasattr(e.response, 'headers'):
+                    retry_after = e.response.headers.get('Retry-After')
+                
+                # 待機時間の計算
+                retry_after_seconds = None
+                if retry_after:
+                    try:
+                        retry_after_seconds = float(retry_after)
+                    except:
+                        pass
+                if retry_after_seconds is not None:
+                    wait_time = retry_after_seconds
+                elif retry_after:
                     wait_time = base_delay * (2 ** attempt)  # 指数バックオフ
-            else:
-                # 指数バックオフ（ランダムジッター付き）
-                wait_time = base_delay * (2 ** attempt) + random.uniform(0, 1)
-            
-            # レート制限エラーの特別処理
-            if any(keyword in error_message for keyword in ['rate limit', '429', 'too many requests']):
-                wait_time = max(wait_time, 30)  # レート制限時は最低30秒
-                st.warning(f"⚠️ レート制限検出。{wait_time:.1f}秒待機後にリトライします... (試行 {attempt + 1}/{max_retries})")
-            else:
-                st.warning(f"🔄 APIエラー発生。{wait_time:.1f}秒待機後にリトライします... (試行 {attempt + 1}/{max_retries})")
-            
-            time.sleep(wait_time)
+                else:
+                    # 指数バックオフ（ランダムジッター付き）
+                    wait_time = base_delay * (2 ** attempt) + random.uniform(0, 1)
+                
+                # レート制限エラーの特別処理
+                rate_limited = any(keyword in error_message for keyword in ['rate limit', '429', 'too many requests'])
+                if rate_limited:
+                    wait_time = max(wait_time, 30)  # レート制限時は最低30秒
+                
+                # レート制限・Retry-Afterは最後の試行でも同じアカウントの全プロセスに共有し、
+                # 次の送信枠の確保で停止明けまで待たせる
+                shared_block = bool(ledger and (rate_limited or retry_after))
+                if shared_block:
+                    ledger.block(wait_time)
+                
+                # 最後の試行の場合は諦める
+                if attempt == max_retries:
+                    return None, f"最大リトライ回数({max_retries})に達しました: {str(e)}"
+                
+                if retry_after_seconds is not None:
+                    notify(f"⏳ サーバーからRetry-After指示: {wait_time}秒待機中...")
+                if rate_limited:
+                    notify(f"⚠️ レート制限検出。{wait_time:.1f}秒待機後にリトライします... (試行 {attempt + 1}/{max_retries})")
+                else:
+                    notify(f"🔄 APIエラー発生。{wait_time:.1f}秒待機後にリトライします... (試行 {attempt + 1}/{max_retries})")
+                
+                if not shared_block:
+                    time.sleep(wait_time)
+    finally:
+        if owns_ledger and ledger:
+            ledger.close()
     
     return None, "予期しないエラー"
 
+# 軽量レスポンスデコード（分析に必要なフィールドのみ保持）
+class LeanTag:
+    """タグ名と翻訳名だけを保持するタグレコード"""
+    __slots__ = ('name', 'translated_name')
+
+    def __init__(self, name, translated_name=None):
+        self.name = name
+        self.translated_name = translated_name
+
+class LeanIllust:
+    """ID・AI種別・タグ・投稿日時だけを保持するイラストレコード"""
+    __slots__ = ('id', 'illust_ai_type', 'tags', 'create_date')
+
+    def __init__(self, illust_id, illust_ai_type, tags, create_date=None):
+        self.id = illust_id
+        self.illust_ai_type = illust_ai_type
+        self.tags = tags
+        self.create_date = create_date
+
+class LeanSearchPage:
+    """検索結果1ページ分（イラスト一覧と次ページURL、APIのエラーメッセージのみ）"""
+    __slots__ = ('illusts', 'next_url', 'error')
+
+    def __init__(self, illusts, next_url, error=None):
+        self.illusts = illusts
+        self.next_url = next_url
+        self.error = error
+
+def api_error_message(data):
+    """レスポンス本文の{"error": {...}}からエラーメッセージを取り出す（エラーでなければNone）"""
+    error = data.get('error') if isinstance(data, dict) else None
+    if not error:
+        return None
+    if isinstance(error, dict):
+        return error.get('user_message') or error.get('message') or error.get('reason') or str(error)
+    return str(error)
+
+def parse_lean_search_page(raw):
+    """レスポンスのバイト列をパースし、必要なフィールドだけのレコードに射影"""
+    data = orjson.loads(raw) if orjson else json.loads(raw)
+
+    illusts = []
+    for item in data.get('illusts') or ():
+        # タグを持たない作品は分析対象外なので保持しない
+        raw_tags = item.get('tags')
+        if raw_tags is None:
+            continue
+        tags = tuple(
+            LeanTag(tag.get('name'), tag.get('translated_name'))
+            for tag in raw_tags if tag.get('name')
+        )
+        illusts.append(LeanIllust(item.get('id'), item.get('illust_ai_type'), tags, item.get('create_date')))
+
+    return LeanSearchPage(illusts, data.get('next_url'), api_error_message(data))
+
+def lean_search_illust(api, params):
+    """search_illustを生レスポンスで呼び出し、軽量レコードとして返す"""
+    url = "%s/v1/search/illust" % api.hosts
+    response = api.no_auth_requests_call("GET", url, params=params, req_auth=True)
+    if response.status_code < 400:
+        return parse_lean_search_page(response.content)
+    
+    try:
+        page = parse_lean_search_page(response.content)
+    except ValueError:
+        page = None
+    error = page.error if page is not None else None
+    
+    # offset上限やアクセストークン切れなどの400はリトライしても変わらないので、
+    # 従来のsearch_illustと同じく空の結果（エラーメッセージ付き）として検索を終了させる
+    if response.status_code == 400 and error:
+        return page
+    
+    # 429などのHTTPエラーは例外にして指数バックオフ側で処理させる
+    # （Pixivはレート制限を403＋本文の"Rate Limit"で返すため、本文のメッセージも例外に含める）
+    from requests.exceptions import HTTPError
+    message = f"{response.status_code} {getattr(response, 'reason', '') or ''}".rstrip()
+    if error:
+        message += f": {error}"
+    raise HTTPError(message, response=response)
+
 def normalize_search_query(query):
     """検索クエリを正規化"""
     import re
@@ -203,25 +479,1047 @@ def detect_r18_content(search_query):
         '裸', 'おっぱい', '巨乳', 'パンツ', 'パンチラ', 'セックス', 'ドm', 'ドs'
     ]
     
-    query_lower = search_query.lower()
-    for keyword in r18_keywords:
-        if keyword in query_lower:
-            return True
-    return False
-
-# 検索方式の説明を取得
-def get_search_mode_description(search_mode):
-    """検索方式の説明を返す"""
-    descriptions = {
-        "partial_match_for_tags": "🏷️ **タグ検索**：作品に付けられたタグのみを検索対象とします",
-        "exact_match_for_tags": "🎯 **タグ完全一致**：タグと完全に一致するもののみを検索します",
-        "title_and_caption": "📝 **タイトル・説明文検索**：作品のタイトルと説明文を検索対象とします",
-        "text": "🔍 **全文検索**：タグ・タイトル・説明文すべてを検索対象とします（最も幅広い検索）"
+    query_lower = search_query.lower()
+    for keyword in r18_keywords:
+        if keyword in query_lower:
+            return True
+    return False
+
+# 検索方式の説明を取得
+def get_search_mode_description(search_mode):
+    """検索方式の説明を返す"""
+    descriptions = {
+        "partial_match_for_tags": "🏷️ **タグ検索**：作品に付けられたタグのみを検索対象とします",
+        "exact_match_for_tags": "🎯 **タグ完全一致**：タグと完全に一致するもののみを検索します",
+        "title_and_caption": "📝 **タイトル・説明文検索**：作品のタイトルと説明文を検索対象とします",
+        "text": "🔍 **全文検索**：タグ・タイトル・説明文すべてを検索対象とします（最も幅広い検索）"
+    }
+    return descriptions.get(search_mode, "不明な検索モード")
+
+# ドリルダウン分析用の転置インデックス
+class TagIndex:
+    """親クエリで収集した作品ごとのタグを保持し、タグ→作品位置のソート済み配列で引く転置インデックス"""
+
+    def __init__(self):
+        self.illust_ids = []  # 位置 → 作品ID
+        self.illust_tags = []  # 位置 → 収集タグ
+        self.postings = {}  # タグ → 作品位置のソート済み配列
+
+    def __len__(self):
+        return len(self.illust_ids)
+
+    def add(self, illust_id, tags):
+        """作品1件分の収集タグを登録（位置は追加順なので配列は常にソート済み）"""
+        from array import array
+        
+        position = len(self.illust_ids)
+        self.illust_ids.append(illust_id)
+        self.illust_tags.append(tuple(tags))
+        for tag in dict.fromkeys(tags):
+            posting = self.postings.get(tag)
+            if posting is None:
+                posting = self.postings[tag] = array('I')
+            posting.append(position)
+
+    def tag_counts(self):
+        """収集タグ全体の出現回数"""
+        counter = Counter()
+        for illust_tags in self.illust_tags:
+            counter.update(illust_tags)
+        return counter
+
+    def tags_by_frequency(self):
+        """出現作品数の多い順にタグを返す"""
+        return sorted(self.postings, key=lambda tag: len(self.postings[tag]), reverse=True)
+
+    def matching_positions(self, tags):
+        """全てのタグを含む作品位置を、ソート済み配列の積集合で求める"""
+        from bisect import bisect_left
+        
+        postings = [self.postings.get(tag) for tag in tags]
+        if not postings or any(posting is None for posting in postings):
+            return []
+        
+        # 最短の配列を基準に、他の配列は二分探索で存在確認
+        postings.sort(key=len)
+        matched = []
+        for position in postings[0]:
+            for posting in postings[1:]:
+                i = bisect_left(posting, position)
+                if i == len(posting) or posting[i] != position:
+                    break
+            else:
+                matched.append(position)
+        return matched
+
+    def drill_down(self, tags, search_mode="partial_match_for_tags", top_n=30):
+        """指定タグを全て含む作品の共起タグを集計し、(該当作品数, 上位タグ)を返す"""
+        positions = self.matching_positions(tags)
+        counter = Counter()
+        for position in positions:
+            illust_tags = self.illust_tags[position]
+            # タグ検索では親クエリの集計と同じ部分一致の規則で除外する
+            # （「B」で絞り込むと「Bx」のような共起タグも除外される）
+            if search_mode in TAG_SEARCH_MODES:
+                illust_tags = exclude_search_tags(illust_tags, tags)
+            else:
+                illust_tags = [tag for tag in illust_tags if tag not in tags]
+            counter.update(illust_tags)
+        return len(positions), counter.most_common(top_n)
+
+# 背景タグ頻度インデックス（全クロール横断のタグ→作品数）
+BACKGROUND_INDEX_PATH = os.path.join(DATA_DIR, "tag_background.idx")
+BACKGROUND_INDEX_MAGIC = b"PXTAGBG1"
+BACKGROUND_INDEX_HEADER = struct.Struct("<8sQQQ")  # マジック, 総作品数, タグ数, 既出作品ID数
+
+def tag_hash(tag):
+    """プロセスをまたいで安定な64bitのタグハッシュ"""
+    import hashlib
+    return int.from_bytes(hashlib.blake2b(tag.encode('utf-8'), digest_size=8).digest(), 'little')
+
+class FileLock:
+    """サイドカーファイルの排他ロック（プロセスをまたいだ読み込み→更新→書き戻しを直列化する）"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = open(self.path, 'a+b')
+        if os.name == 'nt':
+            import msvcrt
+            # LK_LOCKは一定回数の再試行で諦めるため、取得できるまで繰り返す
+            while True:
+                try:
+                    self._file.seek(0)
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        else:
+            import fcntl
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if os.name == 'nt':
+            import msvcrt
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+class TagBackgroundIndex:
+    """タグ→作品数の背景頻度をソート済み固定長配列でディスクに保存し、mmapで参照する
+
+    ファイル構成: ヘッダー / タグハッシュ(uint64, 昇順) / 作品数(uint32) / 既出作品ID(uint64, 昇順)
+    配列はネイティブのバイトオーダーで保存するローカル専用のキャッシュ。
+    """
+
+    def __init__(self, path=BACKGROUND_INDEX_PATH):
+        self.path = path
+        self.total_illusts = 0
+        self._mmap = None
+        self._views = []
+        self._hashes = ()
+        self._counts = ()
+        self._seen_ids = ()
+        self.load()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def load(self):
+        """ディスク上のインデックスをmmapで開く（存在しなければ空）"""
+        import mmap
+        
+        self.close()
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < BACKGROUND_INDEX_HEADER.size:
+            return
+        
+        with open(self.path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, total_illusts, n_tags, n_ids = BACKGROUND_INDEX_HEADER.unpack_from(mm, 0)
+        if magic != BACKGROUND_INDEX_MAGIC:
+            mm.close()
+            return
+        
+        view = memoryview(mm)
+        offset = BACKGROUND_INDEX_HEADER.size
+        hashes = view[offset:offset + 8 * n_tags].cast('Q')
+        offset += 8 * n_tags
+        counts = view[offset:offset + 4 * n_tags].cast('I')
+        offset += 4 * n_tags
+        seen_ids = view[offset:offset + 8 * n_ids].cast('Q')
+        
+        self._mmap = mm
+        self._views = [hashes, counts, seen_ids, view]
+        self._hashes, self._counts, self._seen_ids = hashes, counts, seen_ids
+        self.total_illusts = total_illusts
+
+    def close(self):
+        """mmapを解放"""
+        for view in self._views:
+            view.release()
+        self._views = []
+        self._hashes = self._counts = self._seen_ids = ()
+        self.total_illusts = 0
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def count(self, tag):
+        """タグが付いた作品数（二分探索でmmap上を直接参照）"""
+        from bisect import bisect_left
+        
+        h = tag_hash(tag)
+        i = bisect_left(self._hashes, h)
+        if i < len(self._hashes) and self._hashes[i] == h:
+            return self._counts[i]
+        return 0
+
+    def _has_seen(self, illust_id):
+        from bisect import bisect_left
+        
+        i = bisect_left(self._seen_ids, illust_id)
+        return i < len(self._seen_ids) and self._seen_ids[i] == illust_id
+
+    def add_illusts(self, illusts):
+        """(作品ID, タグ一覧)を背景頻度に加算してディスクへ書き戻し、新規に加算した作品数を返す"""
+        # 他プロセス（別セッション・事前取得デーモン）と同時に書き戻して更新を失わないよう、
+        # 読み込みから置き換えまでをロックして最新のファイルにマージする
+        with FileLock(f"{self.path}.lock"):
+            self.load()
+            return self._merge_illusts(illusts)
+
+    def _merge_illusts(self, illusts):
+        from array import array
+        import heapq
+        
+        new_ids = set()
+        delta = Counter()
+        for illust_id, tags in illusts:
+            if illust_id is None or illust_id in new_ids or self._has_seen(illust_id):
+                continue
+            new_ids.add(illust_id)
+            delta.update({tag_hash(tag) for tag in tags})
+        if not new_ids:
+            return 0
+        
+        counts = dict(zip(self._hashes, self._counts))
+        for h, count in delta.items():
+            counts[h] = counts.get(h, 0) + count
+        hashes = sorted(counts)
+        seen_ids = array('Q', heapq.merge(self._seen_ids, sorted(new_ids)))
+        total_illusts = self.total_illusts + len(new_ids)
+        self.close()
+        
+        # 一時ファイルに書いてから置き換え、読み込み中のプロセスに壊れたファイルを見せない
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(BACKGROUND_INDEX_HEADER.pack(BACKGROUND_INDEX_MAGIC, total_illusts, len(hashes), len(seen_ids)))
+            f.write(array('Q', hashes).tobytes())
+            f.write(array('I', (counts[h] for h in hashes)).tobytes())
+            f.write(seen_ids.tobytes())
+        os.replace(tmp_path, self.path)
+        
+        self.load()
+        return len(new_ids)
+
+# 背景頻度に対する特徴度ランキング
+RANKING_METHODS = {
+    "count": "📊 出現回数（従来の方式）",
+    "lift": "🎯 リフト（全体と比べた偏り）",
+    "tfidf": "⚖️ TF-IDF（出現回数×希少性）"
+}
+RANKING_SCORE_LABELS = {"lift": "リフト", "tfidf": "TF-IDF"}
+
+def rank_tags(tag_counts, query_illust_count, background, method="count", top_n=30):
+    """背景頻度を基準にタグを並べ替え、([(タグ, 出現回数)], {タグ: スコア})を返す"""
+    import math
+    
+    if method == "count" or not background.total_illusts:
+        return tag_counts.most_common(top_n), {}
+    
+    # 出現の少ないタグはリフトが過大になりやすいので足切り
+    min_count = max(2, query_illust_count // 100)
+    total_illusts = background.total_illusts
+    scores = {}
+    for tag, count in tag_counts.items():
+        if count < min_count:
+            continue
+        document_frequency = max(background.count(tag), count)
+        if method == "lift":
+            scores[tag] = (count / query_illust_count) / (document_frequency / total_illusts)
+        else:
+            scores[tag] = count * (math.log((1 + total_illusts) / (1 + document_frequency)) + 1)
+    
+    ranked = sorted(scores, key=scores.get, reverse=True)[:top_n]
+    return [(tag, tag_counts[tag]) for tag in ranked], {tag: scores[tag] for tag in ranked}
+
+# 作品ストア（クロールした作品のID・AI種別・タグを保存し、再分析に使う）
+ILLUST_STORE_PATH = os.path.join(DATA_DIR, "illusts.sqlite3")
+
+class IllustStore:
+    """クロールした作品とクエリごとの所属をSQLiteに保存する"""
+
+    def __init__(self, path=ILLUST_STORE_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30)
+        # 旧形式（目標件数と上位タグを保存していた）の事前取得結果はキャッシュなので作り直す
+        warm_columns = {row[1] for row in self.conn.execute("PRAGMA table_info(warm_results)")}
+        if warm_columns and "found_count" not in warm_columns:
+            self.conn.execute("DROP TABLE warm_results")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS illusts (
+                id INTEGER PRIMARY KEY,
+                ai_type INTEGER,
+                tags TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS query_illusts (
+                query TEXT NOT NULL,
+                search_mode TEXT NOT NULL,
+                illust_id INTEGER NOT NULL,
+                PRIMARY KEY (query, search_mode, illust_id)
+            );
+            CREATE TABLE IF NOT EXISTS watchlist (
+                query TEXT NOT NULL,
+                search_mode TEXT NOT NULL,
+                max_illusts INTEGER NOT NULL,
+                exclude_english INTEGER NOT NULL,
+                exclude_ai INTEGER NOT NULL,
+                added_at REAL NOT NULL,
+                PRIMARY KEY (query, search_mode, exclude_english, exclude_ai)
+            );
+            CREATE TABLE IF NOT EXISTS warm_results (
+                query TEXT NOT NULL,
+                search_mode TEXT NOT NULL,
+                exclude_english INTEGER NOT NULL,
+                exclude_ai INTEGER NOT NULL,
+                found_count INTEGER NOT NULL,
+                crawled_at REAL NOT NULL,
+                illust_ids TEXT NOT NULL,
+                PRIMARY KEY (query, search_mode, exclude_english, exclude_ai)
+            );
+            CREATE TABLE IF NOT EXISTS trend_watermarks (
+                query TEXT NOT NULL,
+                search_mode TEXT NOT NULL,
+                exclude_english INTEGER NOT NULL,
+                exclude_ai INTEGER NOT NULL,
+                newest_illust_id INTEGER NOT NULL,
+                pending_newest_id INTEGER,
+                resume_before_id INTEGER,
+                resume_date TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (query, search_mode, exclude_english, exclude_ai)
+            );
+            CREATE TABLE IF NOT EXISTS trend_buckets (
+                query TEXT NOT NULL,
+                search_mode TEXT NOT NULL,
+                exclude_english INTEGER NOT NULL,
+                exclude_ai INTEGER NOT NULL,
+                bucket TEXT NOT NULL,
+                illust_count INTEGER NOT NULL,
+                PRIMARY KEY (query, search_mode, exclude_english, exclude_ai, bucket)
+            );
+            CREATE TABLE IF NOT EXISTS trend_counts (
+                query TEXT NOT NULL,
+                search_mode TEXT NOT NULL,
+                exclude_english INTEGER NOT NULL,
+                exclude_ai INTEGER NOT NULL,
+                bucket TEXT NOT NULL,
+                tag TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (query, search_mode, exclude_english, exclude_ai, bucket, tag)
+            );
+        """)
+        # 旧形式の差分取得の状態には再開位置の列を追加する
+        trend_columns = {row[1] for row in self.conn.execute("PRAGMA table_info(trend_watermarks)")}
+        for column in ("pending_newest_id INTEGER", "resume_before_id INTEGER", "resume_date TEXT"):
+            if column.split()[0] not in trend_columns:
+                self.conn.execute(f"ALTER TABLE trend_watermarks ADD COLUMN {column}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def save_crawl(self, query, search_mode, illusts):
+        """(作品ID, AI種別, タグ一覧)を保存し、クエリとの対応を記録"""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO illusts (id, ai_type, tags) VALUES (?, ?, ?)",
+                ((illust_id, ai_type, json.dumps(tags, ensure_ascii=False))
+                 for illust_id, ai_type, tags in illusts if illust_id is not None)
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO query_illusts (query, search_mode, illust_id) VALUES (?, ?, ?)",
+                ((query, search_mode, illust_id) for illust_id, _, _ in illusts if illust_id is not None)
+            )
+
+    def get_illusts(self, illust_ids):
+        """指定IDの作品を指定順に(作品ID, AI種別, タグ一覧)で返す（未保存のIDは飛ばす）"""
+        rows = {}
+        ids = list(illust_ids)
+        # SQLiteのパラメータ数上限を避けるため分割して取得
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for illust_id, ai_type, tags in self.conn.execute(
+                f"SELECT id, ai_type, tags FROM illusts WHERE id IN ({placeholders})", chunk
+            ):
+                rows[illust_id] = (illust_id, ai_type, json.loads(tags))
+        return [rows[illust_id] for illust_id in ids if illust_id in rows]
+
+    def save_warm_result(self, query, search_mode, exclude_english, exclude_ai, found_count, illust_ids):
+        """最後まで取得できた分析の該当作品数と取得作品IDを取得日時付きで保存"""
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO warm_results "
+                "(query, search_mode, exclude_english, exclude_ai, found_count, crawled_at, illust_ids) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (query, search_mode, int(exclude_english), int(exclude_ai), found_count, time.time(),
+                 json.dumps(illust_ids))
+            )
+
+    def load_warm_result(self, query, search_mode, exclude_english, exclude_ai):
+        """保存済みの分析結果（なければNone）"""
+        row = self.conn.execute(
+            "SELECT found_count, crawled_at, illust_ids FROM warm_results "
+            "WHERE query = ? AND search_mode = ? AND exclude_english = ? AND exclude_ai = ?",
+            (query, search_mode, int(exclude_english), int(exclude_ai))
+        ).fetchone()
+        if row is None:
+            return None
+        found_count, crawled_at, illust_ids = row
+        return {
+            "found_count": found_count,
+            "crawled_at": crawled_at,
+            "illust_ids": json.loads(illust_ids)
+        }
+
+    def add_watch(self, query, search_mode, max_illusts, exclude_english, exclude_ai):
+        """ウォッチリストにクエリを追加（同じ条件なら取得件数を更新）"""
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO watchlist "
+                "(query, search_mode, max_illusts, exclude_english, exclude_ai, added_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (query, search_mode, max_illusts, int(exclude_english), int(exclude_ai), time.time())
+            )
+
+    def remove_watch(self, query, search_mode, exclude_english, exclude_ai):
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM watchlist WHERE query = ? AND search_mode = ? AND exclude_english = ? AND exclude_ai = ?",
+                (query, search_mode, int(exclude_english), int(exclude_ai))
+            )
+
+    def watchlist(self):
+        """ウォッチリストを最終取得日時の古い順に返す（未取得が先頭）"""
+        rows = self.conn.execute(
+            "SELECT w.query, w.search_mode, w.max_illusts, w.exclude_english, w.exclude_ai, r.crawled_at "
+            "FROM watchlist w LEFT JOIN warm_results r "
+            "ON r.query = w.query AND r.search_mode = w.search_mode "
+            "AND r.exclude_english = w.exclude_english AND r.exclude_ai = w.exclude_ai "
+            "ORDER BY COALESCE(r.crawled_at, 0), w.added_at"
+        ).fetchall()
+        return [
+            {
+                "query": query,
+                "search_mode": search_mode,
+                "max_illusts": max_illusts,
+                "exclude_english": bool(exclude_english),
+                "exclude_ai": bool(exclude_ai),
+                "crawled_at": crawled_at
+            }
+            for query, search_mode, max_illusts, exclude_english, exclude_ai, crawled_at in rows
+        ]
+
+    def trend_state(self, query, search_mode, exclude_english, exclude_ai):
+        """差分取得の状態（未取得ならNone）
+
+        newest_illust_id以前は集計済み。pending_newest_idがあれば、そこからresume_before_idの手前までも集計済みで、
+        resume_before_idより前〜newest_illust_idより後が未取得の範囲になる。
+        """
+        row = self.conn.execute(
+            "SELECT newest_illust_id, pending_newest_id, resume_before_id, resume_date FROM trend_watermarks "
+            "WHERE query = ? AND search_mode = ? AND exclude_english = ? AND exclude_ai = ?",
+            (query, search_mode, int(exclude_english), int(exclude_ai))
+        ).fetchone()
+        if row is None:
+            return None
+        newest_illust_id, pending_newest_id, resume_before_id, resume_date = row
+        return {
+            "newest_illust_id": newest_illust_id,
+            "pending_newest_id": pending_newest_id,
+            "resume_before_id": resume_before_id,
+            "resume_date": resume_date
+        }
+
+    def save_trend_delta(self, query, search_mode, exclude_english, exclude_ai,
+                         state, bucket_illusts, bucket_tags):
+        """差分取得した作品数・タグ数を期間ごとの累計に加算し、差分取得の状態（trend_stateの形式）を更新"""
+        key = (query, search_mode, int(exclude_english), int(exclude_ai))
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO trend_buckets "
+                "(query, search_mode, exclude_english, exclude_ai, bucket, illust_count) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (query, search_mode, exclude_english, exclude_ai, bucket) "
+                "DO UPDATE SET illust_count = illust_count + excluded.illust_count",
+                (key + (bucket, illust_count) for bucket, illust_count in bucket_illusts.items())
+            )
+            self.conn.executemany(
+                "INSERT INTO trend_counts "
+                "(query, search_mode, exclude_english, exclude_ai, bucket, tag, count) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (query, search_mode, exclude_english, exclude_ai, bucket, tag) "
+                "DO UPDATE SET count = count + excluded.count",
+                (key + (bucket, tag, count)
+                 for bucket, tag_counter in bucket_tags.items() for tag, count in tag_counter.items())
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO trend_watermarks "
+                "(query, search_mode, exclude_english, exclude_ai, newest_illust_id, pending_newest_id, "
+                "resume_before_id, resume_date, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                key + (state["newest_illust_id"], state.get("pending_newest_id"), state.get("resume_before_id"),
+                       state.get("resume_date"), time.time())
+            )
+
+    def trend_series(self, query, search_mode, exclude_english, exclude_ai):
+        """期間ごとの該当作品数とタグ集計を({期間: 作品数}, {期間: Counter})で返す（期間の古い順）"""
+        key = (query, search_mode, int(exclude_english), int(exclude_ai))
+        where = "WHERE query = ? AND search_mode = ? AND exclude_english = ? AND exclude_ai = ?"
+        bucket_illusts = dict(self.conn.execute(
+            f"SELECT bucket, illust_count FROM trend_buckets {where} ORDER BY bucket", key
+        ).fetchall())
+        bucket_tags = {bucket: Counter() for bucket in bucket_illusts}
+        for bucket, tag, count in self.conn.execute(
+            f"SELECT bucket, tag, count FROM trend_counts {where}", key
+        ):
+            bucket_tags.setdefault(bucket, Counter())[tag] = count
+        return bucket_illusts, bucket_tags
+
+    def count_illusts(self):
+        return self.conn.execute("SELECT COUNT(*) FROM illusts").fetchone()[0]
+
+    def stored_queries(self):
+        """保存済みのクエリ一覧 [(クエリ, 検索方式, 作品数)]"""
+        return self.conn.execute(
+            "SELECT query, search_mode, COUNT(*) FROM query_illusts "
+            "GROUP BY query, search_mode ORDER BY COUNT(*) DESC"
+        ).fetchall()
+
+    def iter_illusts(self, query=None, search_mode=None):
+        """保存済み作品を(作品ID, AI種別, タグ一覧)で順に返す（クエリ未指定なら全作品）"""
+        if query is None:
+            rows = self.conn.execute("SELECT id, ai_type, tags FROM illusts ORDER BY id")
+        else:
+            rows = self.conn.execute(
+                "SELECT i.id, i.ai_type, i.tags FROM illusts i "
+                "JOIN query_illusts q ON q.illust_id = i.id "
+                "WHERE q.query = ? AND q.search_mode = ? ORDER BY i.id",
+                (query, search_mode)
+            )
+        for illust_id, ai_type, tags in rows:
+            yield illust_id, ai_type, json.loads(tags)
+
+# 取得中の途中経過表示（累計カウンターから上位タグを間引いて再描画）
+LIVE_UPDATE_EVERY_PAGES = 2  # 何ページごとに途中経過を更新するか
+LIVE_UPDATE_MIN_SECONDS = 5.0  # 再描画の最短間隔（秒）
+LIVE_TOP_N = 15  # 途中経過に表示する上位タグ数
+
+class LiveResultsView:
+    """取得中の上位タグ表と棒グラフを、再描画コストを抑えるよう間引いて更新する"""
+
+    def __init__(self, placeholder, every_pages=LIVE_UPDATE_EVERY_PAGES, min_seconds=LIVE_UPDATE_MIN_SECONDS):
+        self.placeholder = placeholder
+        self.every_pages = every_pages
+        self.min_seconds = min_seconds
+        self.last_page = 0
+        self.last_rendered_at = None
+
+    def should_update(self, page):
+        """最初のページは即時、以降はページ数と経過時間の両方を満たしたときだけ更新"""
+        if self.last_rendered_at is None:
+            return True
+        return (page - self.last_page >= self.every_pages and
+                time.monotonic() - self.last_rendered_at >= self.min_seconds)
+
+    def render(self, page, tag_counter, found_count, max_illusts, top_n=LIVE_TOP_N):
+        """累計カウンターの上位タグを表と棒グラフで表示"""
+        import pandas as pd
+        
+        self.last_page = page
+        self.last_rendered_at = time.monotonic()
+        top_tags = tag_counter.most_common(top_n)
+        if not top_tags:
+            return
+        
+        df = pd.DataFrame(top_tags, columns=["タグ名", "使用回数"])
+        df.insert(0, "順位", range(1, len(df) + 1))
+        with self.placeholder.container():
+            st.markdown(f"**⚡ 途中経過（{found_count}/{max_illusts}作品時点の上位{len(top_tags)}タグ）**")
+            st.dataframe(df, use_container_width=True, hide_index=True)
+            st.bar_chart(df.set_index("タグ名")["使用回数"])
+
+    def clear(self):
+        self.placeholder.empty()
+
+# 検索パラメータの組み立て（GUIと事前取得デーモンで共通）
+def build_search_params(search_tags, search_mode, sort="popular_desc", end_date=None):
+    """分割済みの検索タグからsearch_illustのパラメータを作成（end_dateはYYYY-MM-DD、その日以前に絞り込む）"""
+    params = {
+        "word": " ".join(search_tags),
+        "search_target": search_mode,  # ← ここが選択可能になった！
+        "sort": sort,
+        "filter": "for_ios"
+    }
+    if end_date:
+        params["end_date"] = end_date
+    return params
+
+# 取得した作品の集計（重複除外・AI除外・タグ収集、UI非依存）
+DEBUG_SAMPLE_ILLUSTS = 5  # デバッグ情報に詳細を表示する作品数
+
+def illust_tag_names(illust):
+    """作品のタグ名と翻訳名を一覧にする"""
+    illust_tags = []
+    for tag in illust.tags:
+        if hasattr(tag, 'name'):
+            illust_tags.append(tag.name)
+        if hasattr(tag, 'translated_name') and tag.translated_name:
+            illust_tags.append(tag.translated_name)
+    return illust_tags
+
+class TagCrawlAccumulator:
+    """検索結果の作品にフィルターを適用してタグを集計し、保存用の作品データを蓄積する"""
+
+    def __init__(self, search_tags, search_mode, exclude_ai, exclude_english, max_illusts, tag_index=None):
+        self.search_tags = search_tags
+        self.search_mode = search_mode
+        self.exclude_ai = exclude_ai
+        self.exclude_english = exclude_english
+        self.max_illusts = max_illusts
+        self.tag_index = tag_index
+        self.tag_counter = Counter()  # 収集タグの累計（途中経過の表示にもそのまま使う）
+        self.total_tag_count = 0
+        self.processed_count = 0
+        self.found_count = 0
+        self.ai_filtered_count = 0
+        self.duplicate_count = 0
+        self.seen_illust_ids = set()
+        self.crawled_illusts = []  # 背景タグ頻度・作品ストア用（フィルター前の全作品）
+
+    @property
+    def is_full(self):
+        return self.found_count >= self.max_illusts
+
+    def add_illust(self, illust_id, illust_ai_type, illust_tags):
+        """作品1件を集計し、該当した場合は(収集タグ, 英語タグ除外数)、除外時はNoneを返す"""
+        # ページをまたいだ重複作品はスキップ
+        if illust_id in self.seen_illust_ids:
+            self.duplicate_count += 1
+            return None
+        self.seen_illust_ids.add(illust_id)
+
+        self.processed_count += 1
+        self.crawled_illusts.append((illust_id, illust_ai_type, illust_tags))
+
+        # AI画像の除外判定
+        if self.exclude_ai and is_ai_tagged(illust_ai_type, illust_tags):
+            self.ai_filtered_count += 1
+            return None
+
+        # 検索タグ除外と言語フィルターを適用
+        filtered_tags, english_count = collect_illust_tags(
+            illust_tags, self.search_tags, self.search_mode, self.exclude_english
+        )
+
+        self.tag_counter.update(filtered_tags)
+        self.total_tag_count += len(filtered_tags)
+        if self.tag_index is not None:
+            self.tag_index.add(illust_id, filtered_tags)
+        self.found_count += 1
+        return filtered_tags, english_count
+
+    def add_page(self, illusts):
+        """1ページ分を集計し、(処理数, 該当数, AI除外数, 詳細表示用サンプル)を返す"""
+        page_processed_count = 0
+        page_matching_count = 0
+        ai_filtered_before = self.ai_filtered_count
+        samples = []
+
+        # 各イラストをチェック
+        for illust in illusts:
+            if not hasattr(illust, 'tags'):
+                continue
+
+            # タグリストを取得
+            illust_tags = illust_tag_names(illust)
+
+            processed_before = self.processed_count
+            collected = self.add_illust(illust.id, illust.illust_ai_type, illust_tags)
+            page_processed_count += self.processed_count - processed_before
+            if collected is None:
+                continue
+
+            page_matching_count += 1
+            if self.found_count <= DEBUG_SAMPLE_ILLUSTS:
+                filtered_tags, english_count = collected
+                samples.append((self.found_count, filtered_tags, english_count, illust_tags))
+
+            if self.is_full:
+                break
+
+        return page_processed_count, page_matching_count, self.ai_filtered_count - ai_filtered_before, samples
+
+# 検索結果ページの取得ループ（ページ予算・ジッター付き間隔・指数バックオフ、UI非依存）
+class SearchPageCrawler:
+    """計画に従って検索結果ページを順に取得する"""
+
+    def __init__(self, api, search_params, max_illusts, planner, log=None, notify=None, before_request=None,
+                 max_requests=None):
+        self.api = api
+        self.search_params = search_params
+        self.max_illusts = max_illusts
+        self.planner = planner
+        self.log = log or (lambda message: None)
+        self.notify = notify
+        self.before_request = before_request
+        self.max_requests = max_requests  # リトライを含めた送信数の上限（Noneなら制限なし）
+        self.api_calls = 0  # 成功したページ取得の回数
+        self.request_count = 0  # リトライを含めて実際に送信した回数
+        self.page_count = 0
+        self.error = None
+        self.end_of_results = False  # 検索結果を最後まで取得したか
+
+    @property
+    def requests_exhausted(self):
+        return self.max_requests is not None and self.request_count >= self.max_requests
+
+    @property
+    def budget_exhausted(self):
+        """予算切れで目標件数に届かずに終了したか"""
+        return self.planner.matched < self.max_illusts and (
+            self.page_count >= self.planner.page_budget or self.requests_exhausted
+        )
+
+    def _send(self, params):
+        self.request_count += 1
+        return lean_search_illust(self.api, params)
+
+    def pages(self):
+        """取得できたページを順に返す（呼び出し側は次を要求する前にplanner.record_pageを呼ぶ）"""
+        # レート制限台帳は取得の間1回だけ開いて使い回す
+        ledger = open_rate_limit_ledger(self.api)
+        try:
+            yield from self._fetch_pages(ledger)
+        finally:
+            if ledger:
+                ledger.close()
+
+    def _fetch_pages(self, ledger):
+        next_qs = None
+
+        while (self.planner.matched < self.max_illusts and self.page_count < self.planner.page_budget
+               and not self.requests_exhausted):
+            if self.before_request:
+                self.before_request(self.page_count + 1)
+
+            # リトライも送信数の上限に含める
+            max_retries = 3
+            if self.max_requests is not None:
+                max_retries = min(max_retries, self.max_requests - self.request_count - 1)
+
+            # API呼び出し（エラーハンドリング強化版、軽量デコード）
+            page_params = next_qs if next_qs else self.search_params
+            result, error = exponential_backoff_request(
+                self.api,
+                lambda: self._send(page_params),
+                max_retries=max_retries,
+                notify=self.notify,
+                ledger=ledger
+            )
+
+            # エラーが発生した場合の処理
+            if error:
+                self.error = error
+                self.log(f"❌ ページ{self.page_count + 1}: APIエラー - {error}")
+                return
+
+            self.api_calls += 1
+
+            if not result or not result.illusts:
+                reason = f"（APIエラー: {result.error}）" if result and result.error else ""
+                self.end_of_results = not reason
+                self.log(f"❌ ページ{self.page_count + 1}: 検索結果が空です{reason}")
+                return
+
+            yield result
+
+            # 次のページへ
+            next_qs = self.api.parse_qs(result.next_url) if result.next_url else None
+            if not next_qs:
+                self.end_of_results = True
+                self.log("ℹ️ 次のページがありません（検索終了）")
+                return
+
+            self.page_count += 1
+
+            # 動的リクエスト間隔でサーバー負荷を軽減（ランダムジッター付き）
+            if self.page_count < self.planner.page_budget and self.planner.matched < self.max_illusts:
+                # 毎回新しいジッター付き間隔を取得
+                current_interval = get_request_interval(self.max_illusts)
+                time.sleep(current_interval)
+
+                # 大量取得時の追加の配慮
+                if self.max_illusts >= 500 and self.page_count % 10 == 0:
+                    # 10ページごとに少し長めの休憩（ジッター付き）
+                    import random
+                    extra_wait = 3.0 + random.uniform(0, 2.0)
+                    self.log(f"⏱️ 10ページ処理完了、サーバー負荷軽減のため追加休憩中...({extra_wait:.1f}秒)")
+                    time.sleep(extra_wait)
+
+# 取得データの保存（背景タグ頻度・作品ストア・事前取得結果）
+def persist_crawl(normalized_query, search_mode, accumulator, log, save_results=True):
+    """クロール結果をローカルに保存し、次回以降の分析・再分析・即時表示に使えるようにする"""
+    if not accumulator.crawled_illusts:
+        return
+
+    # 背景タグ頻度インデックスを更新（全クロール横断で作品数を蓄積）
+    try:
+        with TagBackgroundIndex() as background:
+            added_count = background.add_illusts(
+                (illust_id, tags) for illust_id, _, tags in accumulator.crawled_illusts
+            )
+            background_total = background.total_illusts
+        log(f"- 背景タグ頻度インデックス: 新規{added_count}作品を追加（累計{background_total}作品）")
+    except OSError as e:
+        log(f"- ⚠️ 背景タグ頻度インデックスの更新に失敗しました: {str(e)}")
+
+    # 再分析用に作品データを保存し、結果が出ていれば次回すぐ表示できるよう保存
+    try:
+        with IllustStore() as store:
+            store.save_crawl(normalized_query, search_mode, accumulator.crawled_illusts)
+            if save_results and accumulator.tag_counter:
+                store.save_warm_result(
+                    normalized_query, search_mode, accumulator.exclude_english, accumulator.exclude_ai,
+                    accumulator.found_count, [illust_id for illust_id, _, _ in accumulator.crawled_illusts]
+                )
+            stored_total = store.count_illusts()
+        log(f"- 作品ストア: {len(accumulator.crawled_illusts)}作品を保存（累計{stored_total}作品）")
+    except sqlite3.Error as e:
+        log(f"- ⚠️ 作品ストアへの保存に失敗しました: {str(e)}")
+
+# 事前取得データからの分析結果の復元（API呼び出しなし）
+WARM_RESULT_MAX_AGE_HOURS = 36  # これより古い事前取得データは使わずに再取得（毎日の事前取得＋時間帯のずれを許容）
+
+def load_warm_analysis(search_query, search_mode, max_illusts, exclude_english, exclude_ai,
+                       max_age_seconds=WARM_RESULT_MAX_AGE_HOURS * 3600):
+    """同じ条件で目標件数以上を取得済みの新しい結果があれば、保存済み作品から集計とドリルダウン用インデックスを復元して返す"""
+    normalized_query = normalize_search_query(search_query)
+    with IllustStore() as store:
+        warm = store.load_warm_result(normalized_query, search_mode, exclude_english, exclude_ai)
+        if warm is None or warm['found_count'] < max_illusts:
+            return None
+        if time.time() - warm['crawled_at'] > max_age_seconds:
+            return None
+        records = store.get_illusts(warm['illust_ids'])
+
+    # 取得時と同じパイプラインで、要求された件数分の作品からタグを再集計
+    # （表・ランキング・ドリルダウンが同じ作品集合を参照するようにする）
+    tag_index = TagIndex()
+    search_tags = normalized_query.split()
+    accumulator = TagCrawlAccumulator(search_tags, search_mode, exclude_ai, exclude_english, max_illusts, tag_index)
+    for illust_id, illust_ai_type, illust_tags in records:
+        accumulator.add_illust(illust_id, illust_ai_type, illust_tags)
+        if accumulator.is_full:
+            break
+
+    return {
+        "query": search_query,
+        "search_mode": search_mode,
+        "results": accumulator.tag_counter.most_common(30),
+        "tag_index": tag_index,
+        "crawled_at": warm['crawled_at']
+    }
+
+# 差分取得によるタグトレンド追跡（新着順に前回の最新作品まで遡り、投稿週ごとの集計に加算）
+TREND_TOP_N = 30  # 期間比較に表示するタグ数
+TREND_CHART_TAGS = 5  # 推移グラフに表示するタグ数
+
+def trend_bucket(create_date):
+    """投稿日時（ISO形式）をその週の月曜日の日付に変換"""
+    import datetime
+    
+    try:
+        day = datetime.date.fromisoformat(create_date[:10])
+    except (TypeError, ValueError):
+        day = datetime.date.today()  # 投稿日時が取れない場合は取得日の週に入れる
+    return (day - datetime.timedelta(days=day.weekday())).isoformat()
+
+# 2回目以降の差分取得は目標件数で打ち切らず、リクエスト予算（既定では検索offsetの上限）まで遡る
+TREND_DELTA_MAX_ILLUSTS = SEARCH_PAGE_SIZE * MAX_SEARCH_PAGES
+
+def crawl_trend_delta(api, search_query, search_mode, exclude_english, exclude_ai, baseline_illusts,
+                      log, notify=None, request_budget=None):
+    """前回の最新作品より新しい作品だけを新着順に取得し、週ごとのタグ集計に加算して取得結果の要約を返す
+
+    初回は新しい順にbaseline_illusts作品を集計して記録を始める。予算切れやエラーで前回の最新作品まで
+    遡れなかった場合は、取得できた範囲だけ加算して最古の取得位置を保存し、次回はその続きから遡る。
+    前回の最新作品に届くまでは最新作品の位置を進めない。
+    """
+    normalized_query = normalize_search_query(search_query)
+    search_tags = normalized_query.split()
+    with IllustStore() as store:
+        state = store.trend_state(normalized_query, search_mode, exclude_english, exclude_ai)
+    
+    first_run = state is None
+    watermark = None if first_run else state["newest_illust_id"]
+    resume_before_id = None if first_run else state["resume_before_id"]
+    if first_run:
+        max_illusts = baseline_illusts
+        log(f"ℹ️ 初回のため、新しい順に最大{max_illusts}作品を取得して記録を開始します")
+    elif resume_before_id is not None:
+        max_illusts = TREND_DELTA_MAX_ILLUSTS
+        log(f"ℹ️ 前回の続き（ID: {resume_before_id}より前、ID: {watermark}より新しい作品）を取得します")
+    else:
+        max_illusts = TREND_DELTA_MAX_ILLUSTS
+        log(f"ℹ️ 前回取得した最新作品（ID: {watermark}）より新しい作品を取得します")
+    
+    # 再開時は前回の最古の取得位置の投稿日以前に絞って、集計済みの範囲を読み直さない
+    search_params = build_search_params(
+        search_tags, search_mode, sort="date_desc",
+        end_date=state["resume_date"] if resume_before_id is not None else None
+    )
+    planner = CrawlPlanner(max_illusts, exclude_ai, max_requests=request_budget)
+    accumulator = TagCrawlAccumulator(search_tags, search_mode, exclude_ai, exclude_english, max_illusts)
+    crawler = SearchPageCrawler(
+        api, search_params, max_illusts, planner, log=log, notify=notify, max_requests=request_budget
+    )
+    
+    bucket_illusts = Counter()
+    bucket_tags = {}
+    newest_fetched = None
+    oldest_fetched = None
+    oldest_date = None
+    reached_watermark = False
+    for page in crawler.pages():
+        page_processed_count = 0
+        page_matching_count = 0
+        for illust in page.illusts:
+            # 投稿日で絞り込んだ再開時は、同じ日のうち前回集計した作品を飛ばす
+            if resume_before_id is not None and illust.id >= resume_before_id:
+                continue
+            # 新着順なので、前回の最新作品に達したら以降はすべて集計済み
+            if watermark is not None and illust.id <= watermark:
+                reached_watermark = True
+                break
+            newest_fetched = max(newest_fetched or 0, illust.id)
+            if oldest_fetched is None or illust.id < oldest_fetched:
+                oldest_fetched, oldest_date = illust.id, illust.create_date
+            
+            processed_before = accumulator.processed_count
+            collected = accumulator.add_illust(illust.id, illust.illust_ai_type, illust_tag_names(illust))
+            page_processed_count += accumulator.processed_count - processed_before
+            if collected is None:
+                continue
+            
+            page_matching_count += 1
+            bucket = trend_bucket(illust.create_date)
+            bucket_illusts[bucket] += 1
+            bucket_tags.setdefault(bucket, Counter()).update(collected[0])
+            if accumulator.is_full:
+                break
+        
+        planner.record_page(page_processed_count, page_matching_count)
+        log(f"- ページ{planner.pages}: 新着{page_processed_count}作品 / 該当{page_matching_count}作品")
+        if reached_watermark or accumulator.is_full:
+            break
+    
+    # 取得できた作品は新着順に連続しているので、途中で終わってもその範囲の集計は正しい
+    gap_closed = first_run or reached_watermark or crawler.end_of_results
+    if crawler.error:
+        log(f"❌ APIエラーのため差分取得を途中で終了しました: {crawler.error}")
+    
+    if first_run:
+        new_state = {"newest_illust_id": newest_fetched} if newest_fetched is not None else None
+    elif gap_closed:
+        # 未取得の範囲がなくなったので、最新作品の位置を今回（再開時は最初の途中終了時）の最新作品まで進める
+        new_state = {"newest_illust_id": state["pending_newest_id"] or newest_fetched or watermark}
+    elif oldest_fetched is not None:
+        # 前回の最新作品までの間が残るので、最新作品の位置は据え置いて続きの位置を保存
+        new_state = {
+            "newest_illust_id": watermark,
+            "pending_newest_id": state["pending_newest_id"] or newest_fetched,
+            "resume_before_id": oldest_fetched,
+            "resume_date": (oldest_date or "")[:10] or None
+        }
+        log(f"⚠️ 前回の最新作品まで遡る前に取得を終了しました。次回はID: {oldest_fetched}より前の続きから取得します")
+    else:
+        new_state = None  # 何も取得できなかったので状態は変えない
+    
+    if crawler.error and new_state is None:
+        return None
+    
+    try:
+        if new_state is not None:
+            with IllustStore() as store:
+                store.save_trend_delta(
+                    normalized_query, search_mode, exclude_english, exclude_ai,
+                    new_state, bucket_illusts, bucket_tags
+                )
+    except sqlite3.Error as e:
+        log(f"❌ トレンドデータの保存に失敗しました: {str(e)}")
+        return None
+    persist_crawl(normalized_query, search_mode, accumulator, log=log, save_results=False)
+    
+    return {
+        "first_run": first_run,
+        "new_illusts": accumulator.processed_count,
+        "matched": accumulator.found_count,
+        "buckets": sorted(bucket_illusts),
+        "api_calls": crawler.api_calls,
+        "gap_remaining": not gap_closed
     }
-    return descriptions.get(search_mode, "不明な検索モード")
+
+def compare_trend_periods(bucket_illusts, bucket_tags, current, previous, top_n=TREND_TOP_N):
+    """2期間のタグ使用率（該当作品に占める割合、%）を比べ、[(タグ, 今期回数, 今期率, 前期率, 増減)]を増減の大きい順に返す"""
+    current_tags = bucket_tags.get(current, Counter())
+    previous_tags = bucket_tags.get(previous, Counter())
+    current_total = bucket_illusts.get(current) or 1
+    previous_total = bucket_illusts.get(previous) or 1
+    
+    # どちらかの期間で上位に入ったタグを比較対象にする
+    candidates = {tag for tag, _ in current_tags.most_common(top_n)}
+    candidates.update(tag for tag, _ in previous_tags.most_common(top_n))
+    
+    rows = []
+    for tag in candidates:
+        current_share = current_tags[tag] / current_total * 100
+        previous_share = previous_tags[tag] / previous_total * 100
+        rows.append((tag, current_tags[tag], round(current_share, 1), round(previous_share, 1),
+                     round(current_share - previous_share, 1)))
+    rows.sort(key=lambda row: abs(row[4]), reverse=True)
+    return rows[:top_n]
 
 # タグ分析（検索方式選択機能付き）
-def analyze_tags(api, search_query, max_illusts, search_mode="partial_match_for_tags"):
+def analyze_tags(api, search_query, max_illusts, search_mode="partial_match_for_tags", tag_index=None):
     if not api:
         st.error("APIが初期化されていません。再ログインしてください。")
         return []
@@ -260,261 +1558,195 @@ def analyze_tags(api, search_query, max_illusts, search_mode="partial_match_for_
         with debug_container:
             st.write("- R18コンテンツ検出: No")
     
-    all_tags = []
-    processed_count = 0
-    found_matching_illusts = 0
-    api_calls = 0
-    ai_filtered_count = 0
+    # AI画像除外・英語タグ除外設定の確認
+    exclude_ai = st.session_state.get('exclude_ai', True)
+    exclude_english = st.session_state.get('exclude_english', True)
+    accumulator = TagCrawlAccumulator(search_tags, search_mode, exclude_ai, exclude_english, max_illusts, tag_index)
+    crawler = None
     
     progress_bar = st.progress(0)
     status_text = st.empty()
     
+    # 取得中の途中経過（ボタンを押すとStreamlitの再実行で取得が止まり、保存済みの途中結果が表示される）
+    st.button("⏹ 取得を中断して途中結果を表示", key="cancel_crawl",
+              help="ここまでに集計したタグで結果を表示します")
+    live_results = LiveResultsView(st.empty())
+    
     try:
-        # 主要なタグから検索開始
-        search_word = " ".join(search_tags)
+        # 検索パラメータ設定（検索方式を選択可能に）
+        search_params = build_search_params(search_tags, search_mode)
         
         with debug_container:
             st.write(f"**🎯 検索実行情報:**")
-            st.write(f"- 検索ワード（複数タグ結合）: `{search_word}`")
+            st.write(f"- 検索ワード（複数タグ結合）: `{search_params['word']}`")
             st.write(f"- 元の分割タグ: {search_tags}")
             st.write(f"- 使用する検索方式: `{search_mode}`")
-        
-        # 検索パラメータ設定（検索方式を選択可能に）
-        search_params = {
-            "word": search_word,
-            "search_target": search_mode,  # ← ここが選択可能になった！
-            "sort": "popular_desc"
-        }
-        
-        # AI画像除外設定の確認
-        exclude_ai = st.session_state.get('exclude_ai', True)
-        
-        with debug_container:
             st.write(f"- 検索パラメータ: {search_params}")
             if exclude_ai:
                 st.write(f"- AI画像除外: **有効** (後処理で判定)")
             else:
                 st.write(f"- AI画像除外: 無効")
         
-        next_qs = None
-        page_count = 0
-        max_pages = max(15, max_illusts // 20)  # 最大ページ数を増加
+        # 該当率と実測時間を学習するクロール計画（予算はUIで設定）
+        time_budget_minutes = st.session_state.get('time_budget_minutes', 45)
+        planner = CrawlPlanner(
+            max_illusts,
+            exclude_ai,
+            max_requests=st.session_state.get('request_budget', 150),
+            time_budget_seconds=time_budget_minutes * 60 if time_budget_minutes else None
+        )
+        
+        # 予算内で目標に届かない場合は開始前に中止
+        feasible, reason = planner.check_feasibility()
+        if not feasible:
+            st.error(f"❌ 予算内で目標件数に到達できないため、分析を開始しませんでした: {reason}")
+            st.info("💡 最大取得数を減らすか、予算設定の時間・リクエスト数を増やしてください。")
+            with debug_container:
+                st.write(f"- 予算チェック: **NG** ({reason})")
+            return None  # 取得していないので「該当なし」とは区別し、前回の結果を残す
         
         with debug_container:
-            st.write(f"- 最大ページ数: {max_pages}")
-            st.write(f"- 予想処理時間: 約{int((max_pages * request_interval) / 60)}分{int((max_pages * request_interval) % 60)}秒")
+            st.write(f"- 初期ページ予算: {planner.page_budget}（該当率の実測に応じて自動調整）")
+            st.write(f"- リクエスト予算: {planner.max_requests}ページ / 時間予算: "
+                     f"{format_duration(planner.time_budget_seconds) if planner.time_budget_seconds else '無制限'}")
+            st.write(f"- 予想処理時間: 約{format_duration(planner.eta_seconds())}")
             st.write("")
             debug_log = st.empty()
         
-        while found_matching_illusts < max_illusts and page_count < max_pages:
-            # 進捗状況をより詳細に表示
-            elapsed_time = page_count * request_interval
-            estimated_total_time = max_pages * request_interval
-            progress_percentage = min((found_matching_illusts / max_illusts) * 100, 100)
-            
-            status_text.text(f"🔍 検索中... ページ{page_count + 1}/{max_pages} | "
-                           f"該当作品: {found_matching_illusts}/{max_illusts} ({progress_percentage:.1f}%) | "
-                           f"経過時間: {int(elapsed_time//60)}:{int(elapsed_time%60):02d}")
-            
-            # API呼び出し（エラーハンドリング強化版）
-            if next_qs:
-                result, error = exponential_backoff_request(
-                    api, 
-                    lambda: api.search_illust(**next_qs),
-                    max_retries=3
-                )
-            else:
-                result, error = exponential_backoff_request(
-                    api, 
-                    lambda: api.search_illust(**search_params),
-                    max_retries=3
-                )
-            
-            # エラーが発生した場合の処理
-            if error:
-                with debug_container:
-                    debug_log.write(f"❌ ページ{page_count + 1}: APIエラー - {error}")
-                st.error(f"APIエラーが発生しました: {error}")
-                break
-            
-            json_result = result
-            api_calls += 1
+        def show_status(page_number):
+            # 進捗状況をより詳細に表示（経過時間とETAは実測値）
+            elapsed_time = planner.elapsed()
+            progress_percentage = min((accumulator.found_count / max_illusts) * 100, 100)
             
+            status_text.text(f"🔍 検索中... ページ{page_number}/{planner.page_budget} | "
+                           f"該当作品: {accumulator.found_count}/{max_illusts} ({progress_percentage:.1f}%) | "
+                           f"経過時間: {int(elapsed_time//60)}:{int(elapsed_time%60):02d} | "
+                           f"残り約{format_duration(planner.eta_seconds())}")
+        
+        crawler = SearchPageCrawler(
+            api, search_params, max_illusts, planner,
+            log=debug_log.write,
+            before_request=show_status
+        )
+        
+        for page in crawler.pages():
             with debug_container:
-                debug_log.write(f"**ページ {page_count + 1} の結果:**\n"
-                              f"- API呼び出し回数: {api_calls}\n"
-                              f"- 取得できた作品数: {len(json_result.illusts) if json_result and hasattr(json_result, 'illusts') else 0}\n"
+                debug_log.write(f"**ページ {crawler.page_count + 1} の結果:**\n"
+                              f"- API呼び出し回数: {crawler.api_calls}\n"
+                              f"- 取得できた作品数: {len(page.illusts)}\n"
                               f"- 実際のリクエスト間隔: {request_interval:.1f}秒（ジッター込み）")
             
-            if not json_result or not hasattr(json_result, 'illusts') or not json_result.illusts:
-                with debug_container:
-                    debug_log.write(f"❌ ページ{page_count + 1}: 検索結果が空です")
-                break
+            page_processed_count, page_matching_count, page_ai_filtered, samples = accumulator.add_page(page.illusts)
             
-            page_matching_count = 0
-            page_processed_count = 0
-            page_ai_filtered = 0
+            # 最初の数件は詳細ログを表示
+            for found_number, filtered_tags, english_count, illust_tags in samples:
+                with debug_container:
+                    debug_log.write(f"✅ 作品 {found_number}: "
+                                  f"収集タグ: {len(filtered_tags)}")
+                    if exclude_english and english_count > 0:
+                        debug_log.write(f"  - 英語タグ除外: {english_count}件")
+                    # 作品のタグ一覧を表示（デバッグ用）
+                    debug_log.write(f"  - 作品のタグ例: {illust_tags[:5]}")
             
-            # 各イラストをチェック
-            for illust in json_result.illusts:
-                if not hasattr(illust, 'tags'):
-                    continue
-                
-                page_processed_count += 1
-                
-                # AI画像の除外判定
-                if exclude_ai and is_ai_generated(illust):
-                    ai_filtered_count += 1
-                    page_ai_filtered += 1
-                    continue
-                
-                # タグリストを取得
-                illust_tags = []
-                for tag in illust.tags:
-                    if hasattr(tag, 'name'):
-                        illust_tags.append(tag.name)
-                    if hasattr(tag, 'translated_name') and tag.translated_name:
-                        illust_tags.append(tag.translated_name)
-                
-                # タグ検索の場合のみ検索タグを除外、キーワード検索の場合は除外しない
-                if search_mode in ["partial_match_for_tags", "exact_match_for_tags"]:
-                    # タグ検索：検索タグを除外した他のタグを収集
-                    filtered_tags = []
-                    for tag in illust_tags:
-                        tag_lower = tag.lower()
-                        is_search_tag = False
-                        
-                        # 検索タグと一致するかチェック
-                        for search_tag in search_tags:
-                            search_tag_lower = search_tag.lower()
-                            if (tag_lower == search_tag_lower or
-                                search_tag_lower in tag_lower or 
-                                tag_lower in search_tag_lower):
-                                is_search_tag = True
-                                break
-                        
-                        if not is_search_tag:
-                            filtered_tags.append(tag)
-                else:
-                    # キーワード検索：全てのタグを収集（検索キーワードも含む）
-                    filtered_tags = illust_tags
-                
-                # 言語フィルターを適用
-                exclude_english = st.session_state.get('exclude_english', True)
-                english_count = 0
-                if exclude_english:
-                    filtered_tags, english_count = filter_tags_by_language(filtered_tags, exclude_english)
-                
-                all_tags.extend(filtered_tags)
-                found_matching_illusts += 1
-                page_matching_count += 1
-                
-                # 最初の数件は詳細ログを表示
-                if found_matching_illusts <= 5:
-                    with debug_container:
-                        debug_log.write(f"✅ 作品 {found_matching_illusts}: "
-                                      f"収集タグ: {len(filtered_tags)}")
-                        if exclude_english and english_count > 0:
-                            debug_log.write(f"  - 英語タグ除外: {english_count}件")
-                        # 作品のタグ一覧を表示（デバッグ用）
-                        debug_log.write(f"  - 作品のタグ例: {illust_tags[:5]}")
-                
-                processed_count += 1
-                if found_matching_illusts >= max_illusts:
-                    break
+            planner.record_page(page_processed_count, page_matching_count)
             
             with debug_container:
                 debug_log.write(f"- このページの該当作品: {page_matching_count}/{page_processed_count}")
+                debug_log.write(f"- 実測該当率: {planner.match_rate * 100:.1f}% / 1ページ平均: {planner.page_seconds:.1f}秒 / "
+                              f"ページ予算: {planner.page_budget}")
                 if exclude_ai and page_ai_filtered > 0:
                     debug_log.write(f"- このページのAI作品除外: {page_ai_filtered}件")
-                debug_log.write(f"- 累計該当作品: {found_matching_illusts}, 累計収集タグ: {len(all_tags)}")
-            
-            progress_bar.progress(min(found_matching_illusts / max_illusts, 1.0))
+                debug_log.write(f"- 累計該当作品: {accumulator.found_count}, 累計収集タグ: {accumulator.total_tag_count}")
             
-            # 次のページへ
-            next_qs = api.parse_qs(json_result.next_url) if hasattr(json_result, 'next_url') and json_result.next_url else None
-            if not next_qs:
-                with debug_container:
-                    debug_log.write("ℹ️ 次のページがありません（検索終了）")
-                break
+            progress_bar.progress(min(accumulator.found_count / max_illusts, 1.0))
             
-            page_count += 1
-            
-            # 動的リクエスト間隔でサーバー負荷を軽減（ランダムジッター付き）
-            if page_count < max_pages and found_matching_illusts < max_illusts:
-                # 毎回新しいジッター付き間隔を取得
-                current_interval = get_request_interval(max_illusts)
-                time.sleep(current_interval)
-                
-                # 大量取得時の追加の配慮
-                if max_illusts >= 500 and page_count % 10 == 0:
-                    # 10ページごとに少し長めの休憩（ジッター付き）
-                    import random
-                    extra_wait = 3.0 + random.uniform(0, 2.0)
-                    with debug_container:
-                        debug_log.write(f"⏱️ 10ページ処理完了、サーバー負荷軽減のため追加休憩中...({extra_wait:.1f}秒)")
-                    time.sleep(extra_wait)
+            # 途中経過を間引いて表示し、中断に備えて暫定結果をセッションに保持
+            if live_results.should_update(planner.pages):
+                live_results.render(planner.pages, accumulator.tag_counter, accumulator.found_count, max_illusts)
+                if tag_index is not None:
+                    st.session_state.analysis = {
+                        "query": search_query,
+                        "search_mode": search_mode,
+                        "results": accumulator.tag_counter.most_common(30),
+                        "tag_index": tag_index,
+                        "partial": True
+                    }
+        
+        # エラーが発生した場合の処理
+        if crawler.error:
+            st.error(f"APIエラーが発生しました: {crawler.error}")
+        
+        # 予算切れで目標件数に届かなかった場合の通知
+        if crawler.budget_exhausted:
+            st.warning(f"⏱️ 予算の上限に達したため、{accumulator.found_count}/{max_illusts}件で取得を終了しました。")
     
     except Exception as e:
         st.error(f"データ取得中にエラーが発生しました: {str(e)}")
         with debug_container:
             st.write(f"**❌ エラー詳細:**")
             st.write(f"- エラーメッセージ: {str(e)}")
-            st.write(f"- エラー発生時点での処理済み作品数: {processed_count}")
-            st.write(f"- エラー発生時点での該当作品数: {found_matching_illusts}")
-            st.write(f"- API呼び出し回数: {api_calls}")
+            st.write(f"- エラー発生時点での処理済み作品数: {accumulator.processed_count}")
+            st.write(f"- エラー発生時点での該当作品数: {accumulator.found_count}")
+            st.write(f"- API呼び出し回数: {crawler.api_calls if crawler else 0}")
         return []
     
     finally:
         progress_bar.empty()
         status_text.empty()
+        live_results.clear()
+    
+    # 背景タグ頻度・作品ストア・事前取得結果を保存（途中で終了した取得は事前取得結果にしない）
+    persist_crawl(
+        normalized_query, search_mode, accumulator, log=debug_container.write,
+        save_results=not crawler.error and not crawler.budget_exhausted
+    )
     
     # 最終結果のデバッグ情報
     with debug_container:
         st.write(f"**📊 最終結果:**")
-        st.write(f"- 総処理作品数: {processed_count}")
-        st.write(f"- 該当作品数: {found_matching_illusts}")
-        st.write(f"- 収集タグ総数: {len(all_tags)}")
-        st.write(f"- ユニークタグ数: {len(set(all_tags)) if all_tags else 0}")
-        st.write(f"- API呼び出し回数: {api_calls}")
-        st.write(f"- 処理ページ数: {page_count}")
+        st.write(f"- 総処理作品数: {accumulator.processed_count}")
+        st.write(f"- 該当作品数: {accumulator.found_count}")
+        st.write(f"- 収集タグ総数: {accumulator.total_tag_count}")
+        st.write(f"- ユニークタグ数: {len(accumulator.tag_counter)}")
+        st.write(f"- API呼び出し回数: {crawler.api_calls}")
+        st.write(f"- 処理ページ数: {crawler.page_count}")
+        st.write(f"- 重複作品スキップ: {accumulator.duplicate_count}件")
         st.write(f"- 使用した検索方式: `{search_mode}`")
         st.write(f"- 平均リクエスト間隔: {request_interval:.1f}秒（ジッター込み）")
-        st.write(f"- 総処理時間: 約{int((page_count * request_interval) // 60)}分{int((page_count * request_interval) % 60)}秒")
+        st.write(f"- 1ページ平均所要時間（実測）: {planner.page_seconds:.1f}秒")
+        st.write(f"- 実測該当率: {planner.match_rate * 100:.1f}%")
+        st.write(f"- 総処理時間: 約{format_duration(planner.elapsed())}")
         
         # 言語・AI画像フィルターの結果を表示
-        exclude_english = st.session_state.get('exclude_english', True)
-        exclude_ai = st.session_state.get('exclude_ai', True)
         if exclude_english:
             st.write(f"- 英語タグ除外: **有効**")
         else:
             st.write(f"- 英語タグ除外: 無効")
         if exclude_ai:
-            st.write(f"- AI画像除外: **有効** (除外数: {ai_filtered_count}件)")
+            st.write(f"- AI画像除外: **有効** (除外数: {accumulator.ai_filtered_count}件)")
         else:
             st.write(f"- AI画像除外: 無効")
     
-    if not all_tags:
+    if not accumulator.tag_counter:
         st.warning(f"条件に一致するタグが見つかりませんでした。")
-        st.info(f"📊 処理結果: {processed_count}作品を確認し、{found_matching_illusts}作品が条件に該当しました。")
-        if exclude_ai and ai_filtered_count > 0:
-            st.info(f"🤖 AI画像を{ai_filtered_count}件除外しました。")
-        if found_matching_illusts == 0:
+        st.info(f"📊 処理結果: {accumulator.processed_count}作品を確認し、{accumulator.found_count}作品が条件に該当しました。")
+        if exclude_ai and accumulator.ai_filtered_count > 0:
+            st.info(f"🤖 AI画像を{accumulator.ai_filtered_count}件除外しました。")
+        if accumulator.found_count == 0:
             st.info("💡 **解決のヒント**:")
             st.info("- タグ名のスペルを確認してください")
-            st.info("- より一般的なタグで試してください") 
+            st.info("- より一般的なタグで試してください")
             st.info("- 単一のタグで検索してみてください")
             st.info("- R18タグの場合、ログイン状態を確認してください")
             st.info("- 検索方式を「全文検索」に変更してみてください")
         return []
     
-    result_info = f"✅ {found_matching_illusts}件の該当作品から{len(all_tags)}個のタグを収集しました。"
-    if exclude_ai and ai_filtered_count > 0:
-        result_info += f" (AI画像{ai_filtered_count}件を除外)"
+    result_info = f"✅ {accumulator.found_count}件の該当作品から{accumulator.total_tag_count}個のタグを収集しました。"
+    if exclude_ai and accumulator.ai_filtered_count > 0:
+        result_info += f" (AI画像{accumulator.ai_filtered_count}件を除外)"
     st.info(result_info)
     
-    counter = Counter(all_tags)
-    return counter.most_common(30)
+    return accumulator.tag_counter.most_common(30)
 
 # Pixiv検索URLを生成する関数
 def create_pixiv_search_url(original_query, additional_tag):
@@ -534,7 +1766,7 @@ def create_pixiv_search_url(original_query, additional_tag):
     return f"https://www.pixiv.net/tags/{encoded_query}/artworks"
 
 # クリック可能なタグテーブルを作成する関数
-def create_clickable_tag_table(tag_data, original_query):
+def create_clickable_tag_table(tag_data, original_query, scores=None, score_label="スコア"):
     """クリック可能なリンク付きのタグテーブルを作成"""
     if not tag_data:
         st.warning("表示するデータがありません。")
@@ -555,12 +1787,15 @@ def create_clickable_tag_table(tag_data, original_query):
         search_url = create_pixiv_search_url(original_query, tag)
         combined_query = f"{normalize_search_query(original_query)} {tag}"
         
-        table_data.append({
+        row = {
             "順位": i,
             "タグ名": tag,
-            "使用回数": f"{count}回",
-            "組み合わせ検索": f"🔍 Pixivで検索 ({combined_query})"
-        })
+            "使用回数": f"{count}回"
+        }
+        if scores:
+            row[score_label] = f"{scores[tag]:.2f}"
+        row["組み合わせ検索"] = f"🔍 Pixivで検索 ({combined_query})"
+        table_data.append(row)
         
         urls_data.append({
             "tag": tag,
@@ -597,6 +1832,8 @@ def create_clickable_tag_table(tag_data, original_query):
 
 # 円グラフ表示（改良版）
 def plot_pie_chart(tag_data, original_query):
+    import matplotlib.pyplot as plt
+    
     if not tag_data:
         st.warning("表示するデータがありません。")
         return
@@ -645,222 +1882,712 @@ def plot_pie_chart(tag_data, original_query):
         for i, (tag, count) in enumerate(tag_data[:15], 1):
             st.write(f"{i}. {tag}: {count}回")
 
-# メインGUI
-st.set_page_config(
-    page_title="Pixiv タグ共起分析ツール", 
-    layout="centered",
-    initial_sidebar_state="collapsed"
-)
+# ドリルダウン分析の表示（取得済み作品の転置インデックスのみを使用）
+def render_drill_down(analysis):
+    """親クエリの取得済み作品から「元のクエリ + タグ」の共起を集計して表示"""
+    tag_index = analysis['tag_index']
+    
+    st.subheader("🔎 ドリルダウン分析（追加のAPI呼び出しなし）")
+    st.markdown("💡 **タグを選ぶと、取得済みの作品だけで「元のクエリ + 選択タグ」の共起タグを即座に集計します**")
+    
+    drill_tags = st.multiselect(
+        "絞り込むタグ（複数選択で A + B + C）",
+        options=tag_index.tags_by_frequency(),
+        key='drill_tags',
+        help="選択したタグをすべて含む作品だけで共起タグを再集計します"
+    )
+    if not drill_tags:
+        return
+    
+    started = time.perf_counter()
+    matched_count, tag_data = tag_index.drill_down(drill_tags, analysis['search_mode'])
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    
+    combined_query = f"{normalize_search_query(analysis['query'])} {' '.join(drill_tags)}"
+    st.info(f"『{combined_query}』: 取得済み{len(tag_index)}作品中 {matched_count}作品が該当（集計 {elapsed_ms:.1f}ms）")
+    
+    if not tag_data:
+        st.warning("選択したタグの組み合わせで共起するタグはありませんでした。")
+        return
+    
+    create_clickable_tag_table(tag_data, combined_query)
 
-st.title("🎨 Pixiv タグ共起分析ツール（検索方式選択機能付き）")
-st.markdown("**複数タグの組み合わせで、一緒によく使われるタグを分析します**")
-
-# セッション状態の初期化
-if 'logged_in' not in st.session_state:
-    st.session_state.logged_in = False
-
-# 使い方説明
-with st.expander("📖 使い方と新機能（検索方式選択）"):
-    st.markdown("""
-    **🆕 新機能: 検索方式選択**:
-    - **タグ検索**: 作品に付けられたタグのみを検索（従来の方式）
-    - **キーワード検索**: タイトル・説明文も含めて検索（Pixivウェブに近い）
-    - **全文検索**: タグ・タイトル・説明文すべてを検索（最も幅広い）
-    - **タグ完全一致**: タグと完全に一致するもののみ（最も厳密）
-    
-    **🔧 修正内容**:
-    - **検索方式を選択可能に**: タグ検索とキーワード検索を選べるようになりました
-    - **クリック可能な検索リンク機能**: タグをクリックして組み合わせ検索が可能
-    - AI画像の判定を後処理で実行（タグベースでの判定）
-    - 複数タグ検索の論理を改善
-    - R18コンテンツの検索処理を最適化
-    - **詳細なデバッグ情報を追加**
-    
-    **📝 使用方法**:
-    1. **refresh_token を取得**: Pixivにログインして開発者ツールから取得
-    2. **ログイン**: 上記のトークンを入力してログインボタンを押す
-    3. **🆕 検索方式を選択**: タグ検索かキーワード検索かを選ぶ
-    4. **検索**: 複数タグの場合は `タグA タグB` の形式で入力
-    5. **分析開始**: ボタンを押して結果を待つ
-    6. **🆕 組み合わせ検索**: 結果のタグをクリックして元のタグと組み合わせ検索！
-    
-    **🔍 検索方式の違い**:
-    
-    | 検索方式 | 検索対象 | 特徴 | おすすめ用途 |
-    |----------|----------|------|-------------|
-    | **タグ検索** | タグのみ | 従来の方式、精度高い | タグの共起関係を調べたい |
-    | **キーワード検索** | タイトル・説明文 | 作品の内容を反映 | 特定のテーマ・ストーリーを探す |
-    | **全文検索** | タグ・タイトル・説明文 | 最も幅広い検索 | できるだけ多くの作品を見つけたい |
-    | **タグ完全一致** | タグ（完全一致） | 最も厳密 | 正確なタグ名で絞り込みたい |
-    
-    **🔗 新機能: クリック可能な検索リンク**:
-    - 分析結果のタグをクリックすると、自動でPixiv検索画面に移動
-    - 元の検索タグと組み合わせた検索が実行されます
-    - 例: 「おっぱい」で分析→「オリジナル」をクリック→「おっぱい オリジナル」で検索
-    - 新しいタブで開くので、分析結果を見ながら検索可能
-    
-    **🔍 デバッグ機能について**:
-    - 分析実行時に「詳細な処理状況（デバッグ情報）」が表示されます
-    - うまく動かない時は、この情報を確認してください：
-      - どのタグで検索しているか
-      - 何件の作品が見つかったか  
-      - どこでエラーが起きているか
-      - API呼び出しが成功しているか
-      - 英語タグが何件除外されたか
-      - AI画像が何件除外されたか
-      - どの検索方式を使用しているか
-    
-    **🔤 英語タグ除外機能**:
-    - 日本語（ひらがな・カタカナ・漢字）を含むタグのみを表示
-    - 「anime」「cute」「girl」などの英語タグを自動で除外
-    - より日本のPixivユーザーに関連性の高い結果が得られます
-    
-    **🤖 AI画像除外機能（修正版）**:
-    - タグベースでAI生成画像を判定・除外
-    - 「ai」「ai生成」「stable diffusion」などのタグを持つ作品を除外
-    - より人間が描いた作品に特化したタグ分析が可能
-    - API制限を回避するため後処理で判定
-    
-    **💡 検索のコツ**:
-    - **検索件数を増やしたい場合**: 「全文検索」を選択
-    - **精密なタグ関係を調べたい場合**: 「タグ検索」を選択
-    - **作品の内容重視の場合**: 「キーワード検索」を選択
-    - **⚠️ 大量取得時の注意**: 500件以上の取得には時間がかかります（15-40分程度）
-    - **サーバー負荷軽減**: 最低1.5秒間隔＋ランダムジッター＋自動リトライ機能
-    - **エラー時の自動対応**: 指数バックオフとRetry-After尊重でサーバーに優しく
-    - R18系タグは最初は少ない取得数（30-50件）で試してください
-    - 複数タグは関連性の高いものを組み合わせてください
-    - うまくいかない場合は「デバッグ情報」を確認してください
-    
-    **例**: `ドMホイホイ R-18` や `初音ミク VOCALOID` や `猫 可愛い`
-    """)
-
-# ログインセクション
-st.subheader("🔐 Pixivログイン")
-refresh_token = st.text_input(
-    "Pixiv refresh_token", 
-    type="password",
-    help="Pixivの開発者ツールから取得してください"
-)
+# 保存データの並列再分析（API呼び出しなし）
+def render_stored_reanalysis():
+    """作品ストアの保存データを、現在のフィルター設定でプロセスプールにより再集計して表示"""
+    from concurrent.futures.process import BrokenProcessPool
+    
+    st.subheader("💾 保存データの並列再分析")
+    st.markdown("💡 **これまでに取得した作品を、現在のフィルター設定で再集計します（APIは呼び出しません）**")
+
+    with IllustStore() as store:
+        stored_queries = store.stored_queries()
+        stored_total = store.count_illusts()
+
+    if not stored_queries:
+        st.info("保存済みの作品はまだありません。分析を実行すると自動で保存されます。")
+        return
+
+    # 選択肢: 保存済みのクエリごと + 全保存作品
+    options = [None] + stored_queries
+    target = st.selectbox(
+        "再分析の対象",
+        options=options,
+        format_func=lambda x: f"全保存作品（{stored_total}件）" if x is None else f"『{x[0]}』 / {x[1]}（{x[2]}件）",
+        help="クエリを選ぶとそのクエリで取得した作品だけを、全保存作品を選ぶと蓄積した全作品を再集計します"
+    )
+    workers = st.number_input(
+        "並列プロセス数",
+        min_value=1,
+        max_value=max(os.cpu_count() or 1, 1),
+        value=max(os.cpu_count() or 1, 1),
+        help=f"{PARALLEL_MIN_ILLUSTS}件未満の場合は単一プロセスで集計します"
+    )
+
+    if not st.button("⚡ 並列再分析を実行"):
+        return
+
+    query, search_mode = (None, "text") if target is None else (target[0], target[1])
+    search_tags = query.split() if query else []
+    exclude_ai = st.session_state.get('exclude_ai', True)
+    exclude_english = st.session_state.get('exclude_english', True)
+
+    started = time.perf_counter()
+    with st.spinner("保存データを再集計中..."):
+        with IllustStore() as store:
+            records = list(store.iter_illusts(query, search_mode))
+        try:
+            counter, stats = parallel_count_tags(
+                records, search_tags, search_mode, exclude_ai, exclude_english, workers=workers
+            )
+        except BrokenProcessPool:
+            # メモリ不足などでワーカーが異常終了した場合は単一プロセスで集計し直す
+            st.warning("⚠️ 並列処理のワーカープロセスが異常終了したため、単一プロセスで集計し直しました。")
+            counter, stats = parallel_count_tags(
+                records, search_tags, search_mode, exclude_ai, exclude_english, workers=1
+            )
+    elapsed = time.perf_counter() - started
+
+    st.info(f"✅ {stats['processed']}作品を{stats['workers']}プロセスで再集計しました（{elapsed:.1f}秒）: "
+            f"該当{stats['matched']}作品 / AI画像除外{stats['ai_filtered']}件 / 英語タグ除外{stats['english_filtered']}件")
+
+    tag_data = counter.most_common(30)
+    if not tag_data:
+        st.warning("条件に一致するタグが見つかりませんでした。")
+        return
 
-col1, col2 = st.columns([1, 1])
-with col1:
-    if st.button("🚀 ログイン", type="primary"):
-        pixiv_login(refresh_token)
+    create_clickable_tag_table(tag_data, query or "")
+
+# タグトレンド追跡の表示
+def render_trend_tracking(tag_query, search_mode, max_count):
+    """差分取得で週ごとのタグ集計を更新し、使用率の推移と期間比較を表示"""
+    import pandas as pd
+    
+    st.subheader("📈 タグトレンド追跡（差分取得）")
+    st.markdown("💡 **新着順に前回取得した最新作品まで遡って新しい作品だけを取得し、投稿週ごとの集計に加算します**")
+    
+    normalized_query = normalize_search_query(tag_query)
+    exclude_english = st.session_state.get('exclude_english', True)
+    exclude_ai = st.session_state.get('exclude_ai', True)
+    
+    if st.button("🔄 新着分を取得してトレンドを更新"):
+        if not st.session_state.get('logged_in', False):
+            st.warning("⚠️ 先にPixivへログインしてください。")
+        elif not normalized_query:
+            st.warning("⚠️ 検索タグ・キーワードを入力してください。")
+        else:
+            api = get_pixiv_api()
+            if api:
+                log_container = st.expander("🔍 差分取得の処理状況", expanded=False)
+                with st.spinner("新着作品を取得中..."):
+                    summary = crawl_trend_delta(
+                        api, normalized_query, search_mode, exclude_english, exclude_ai, max_count,
+                        log=log_container.write, notify=st.warning,
+                        request_budget=st.session_state.get('request_budget')
+                    )
+                if summary:
+                    st.success(f"✅ 新着{summary['new_illusts']}作品を確認し、{summary['matched']}作品を"
+                               f"{len(summary['buckets'])}週分の集計に加算しました（{summary['api_calls']}リクエスト）")
+                    if summary['gap_remaining']:
+                        st.info("ℹ️ 前回の取得位置まで遡れなかったため、次回の更新で残りの新着作品を続けて取得します")
+                else:
+                    st.error("❌ 差分取得に失敗しました。処理状況を確認してください。")
+            else:
+                st.error("❌ API接続に問題があります。再ログインしてください。")
+    
+    if not normalized_query:
+        return
+    
+    with IllustStore() as store:
+        bucket_illusts, bucket_tags = store.trend_series(normalized_query, search_mode, exclude_english, exclude_ai)
+    
+    if not bucket_illusts:
+        st.info("この条件のトレンドデータはまだありません。「新着分を取得」で記録を開始します。")
+        return
+    
+    buckets = list(bucket_illusts)
+    st.caption(f"記録済み: {buckets[0]}週〜{buckets[-1]}週（{len(buckets)}週、該当{sum(bucket_illusts.values())}作品）"
+               "。最新週は集計途中の場合があります")
+    
+    # 全期間の上位タグについて、週ごとの使用率の推移を表示
+    total_tags = Counter()
+    for tag_counter in bucket_tags.values():
+        total_tags.update(tag_counter)
+    chart_tags = [tag for tag, _ in total_tags.most_common(TREND_CHART_TAGS)]
+    chart_df = pd.DataFrame(
+        {tag: [bucket_tags[bucket][tag] / bucket_illusts[bucket] * 100 for bucket in buckets] for tag in chart_tags},
+        index=buckets
+    )
+    st.markdown("**使用率の推移（該当作品に占める割合、%）**")
+    st.line_chart(chart_df)
+    
+    if len(buckets) < 2:
+        st.info("💡 2週分以上のデータがたまると、期間ごとの増減を比較できます。")
+        return
+    
+    # 期間比較（既定は直近2週）
+    col_current, col_previous = st.columns([1, 1])
+    with col_current:
+        current = st.selectbox("比較する期間", options=buckets[::-1], index=0, key="trend_current")
+    with col_previous:
+        previous = st.selectbox("比較元の期間", options=buckets[::-1], index=1, key="trend_previous")
+    
+    rows = compare_trend_periods(bucket_illusts, bucket_tags, current, previous)
+    df = pd.DataFrame(rows, columns=["タグ名", "使用回数", f"使用率(%) {current}週", f"使用率(%) {previous}週", "増減(ポイント)"])
+    st.dataframe(df, use_container_width=True, hide_index=True)
 
-with col2:
-    if st.session_state.get('logged_in', False):
-        st.success("✅ ログイン済み")
+# ウォッチリストの表示と編集
+def format_freshness(crawled_at):
+    """取得日時と経過時間を表示用に整形"""
+    import datetime
+    
+    if not crawled_at:
+        return "未取得"
+    age = time.time() - crawled_at
+    if age < 3600:
+        ago = f"{int(age // 60)}分前"
+    elif age < 86400:
+        ago = f"{int(age // 3600)}時間前"
     else:
-        st.error("❌ ログインが必要")
-
-# 検索セクション
-st.markdown("---")
-st.subheader("🔍 タグ分析")
-
-# 🆕 検索方式選択
-st.markdown("**🆕 検索方式選択**")
-search_mode_options = {
-    "partial_match_for_tags": "🏷️ タグ検索（部分一致）- 従来の方式",
-    "exact_match_for_tags": "🎯 タグ完全一致 - より厳密",
-    "title_and_caption": "📝 キーワード検索（タイトル・説明文）- 作品内容重視",
-    "text": "🔍 全文検索（タグ・タイトル・説明文）- 最も幅広い"
-}
+        ago = f"{int(age // 86400)}日前"
+    return f"{datetime.datetime.fromtimestamp(crawled_at):%Y-%m-%d %H:%M}（{ago}）"
 
-search_mode = st.selectbox(
-    "検索方式を選択してください",
-    options=list(search_mode_options.keys()),
-    format_func=lambda x: search_mode_options[x],
-    index=0,  # デフォルトはタグ検索
-    help="検索対象を選択できます。全文検索にするとPixivウェブサイトの検索に近い結果が得られます。"
-)
+def render_watchlist(tag_query, search_mode, max_count):
+    """ウォッチリスト（事前取得デーモンが毎日再取得するクエリ）の追加・削除と鮮度の表示"""
+    st.subheader("⭐ ウォッチリスト（事前取得）")
+    st.markdown("💡 **登録したクエリは事前取得デーモンがオフピーク時間帯に再取得し、分析開始時に即時表示されます**")
+    
+    exclude_english = st.session_state.get('exclude_english', True)
+    exclude_ai = st.session_state.get('exclude_ai', True)
+    
+    if st.button("⭐ 現在の条件をウォッチリストに追加"):
+        if tag_query.strip():
+            with IllustStore() as store:
+                store.add_watch(normalize_search_query(tag_query), search_mode, max_count, exclude_english, exclude_ai)
+            st.success(f"『{normalize_search_query(tag_query)}』をウォッチリストに追加しました。")
+        else:
+            st.warning("⚠️ 検索タグ・キーワードを入力してください。")
+    
+    with IllustStore() as store:
+        entries = store.watchlist()
+    
+    if not entries:
+        st.info("ウォッチリストは空です。")
+    
+    for i, entry in enumerate(entries):
+        col_entry, col_remove = st.columns([4, 1])
+        with col_entry:
+            filters = []
+            if entry['exclude_english']:
+                filters.append("英語タグ除外")
+            if entry['exclude_ai']:
+                filters.append("AI除外")
+            st.markdown(f"**{entry['query']}** / `{entry['search_mode']}` / {entry['max_illusts']}件"
+                        f"{' / ' + '・'.join(filters) if filters else ''}  \n"
+                        f"🕒 最終取得: {format_freshness(entry['crawled_at'])}")
+        with col_remove:
+            if st.button("削除", key=f"remove_watch_{i}"):
+                with IllustStore() as store:
+                    store.remove_watch(entry['query'], entry['search_mode'], entry['exclude_english'], entry['exclude_ai'])
+                st.rerun()
+    
+    st.caption("事前取得デーモンの起動: `python pixiv_illust_analyzer.py --prewarm --refresh-token <refresh_token>` "
+               f"（既定では{PREWARM_DEFAULT_WINDOW}時台に最大{PREWARM_DEFAULT_REQUEST_BUDGET}リクエストまで取得）")
 
-# 選択した検索方式の説明を表示
-st.info(get_search_mode_description(search_mode))
+# 事前取得デーモン（ウォッチリストのクエリをオフピーク時間帯に再取得）
+PREWARM_DEFAULT_WINDOW = "3-6"  # 取得を行う時間帯（時）
+PREWARM_DEFAULT_REQUEST_BUDGET = 300  # 1回の時間帯で使う検索リクエスト数の上限
 
-# フィルター設定
-st.markdown("**🔧 フィルター設定**")
-col_setting1, col_setting2 = st.columns([1, 1])
+def parse_hour_window(window):
+    """「開始時-終了時」形式の時間帯を(開始時, 終了時)に変換（0-24などの24時間指定も可）"""
+    start_hour, end_hour = (int(hour) for hour in window.split('-'))
+    if not (0 <= start_hour < 24 and 0 <= end_hour <= 24) or start_hour == end_hour:
+        raise ValueError(f"時間帯の指定が不正です: {window}")
+    return start_hour, end_hour
 
-with col_setting1:
-    exclude_english = st.checkbox(
-        "🔤 英語タグを除外する", 
-        value=st.session_state.get('exclude_english', True),
-        help="チェックすると、結果から英語のタグを除外し、日本語タグのみを表示します"
+def next_hour_window(now, start_hour, end_hour):
+    """実行中またはこれから始まる時間帯の(開始日時, 終了日時)を返す"""
+    import datetime
+    
+    duration = datetime.timedelta(hours=(end_hour - start_hour) % 24 or 24)
+    today_start = now.replace(hour=start_hour, minute=0, second=0, microsecond=0)
+    for days in (-1, 0, 1):
+        window_start = today_start + datetime.timedelta(days=days)
+        if now < window_start + duration:
+            return window_start, window_start + duration
+    return today_start + datetime.timedelta(days=1), today_start + datetime.timedelta(days=1) + duration
+
+def prewarm_query(api, entry, request_budget, log, time_budget_seconds=None):
+    """ウォッチリストの1クエリをGUIと同じ検索方式・フィルターで取得して保存し、リトライを含めて送信したリクエスト数を返す"""
+    normalized_query = normalize_search_query(entry['query'])
+    search_tags = normalized_query.split()
+    
+    planner = CrawlPlanner(
+        entry['max_illusts'], entry['exclude_ai'], max_requests=request_budget, time_budget_seconds=time_budget_seconds
+    )
+    feasible, reason = planner.check_feasibility()
+    if not feasible:
+        log(f"スキップ『{normalized_query}』: {reason}")
+        return 0
+    
+    accumulator = TagCrawlAccumulator(
+        search_tags, entry['search_mode'], entry['exclude_ai'], entry['exclude_english'], entry['max_illusts']
+    )
+    crawler = SearchPageCrawler(
+        api, build_search_params(search_tags, entry['search_mode']), entry['max_illusts'], planner,
+        log=log, notify=log, max_requests=request_budget
     )
-    st.session_state.exclude_english = exclude_english
+    try:
+        for page in crawler.pages():
+            page_processed_count, page_matching_count, _, _ = accumulator.add_page(page.illusts)
+            planner.record_page(page_processed_count, page_matching_count)
+        
+        if crawler.error:
+            log(f"APIエラー『{normalized_query}』: {crawler.error}")
+        persist_crawl(
+            normalized_query, entry['search_mode'], accumulator, log=log,
+            save_results=not crawler.error and not crawler.budget_exhausted
+        )
+        log(f"完了『{normalized_query}』: 該当{accumulator.found_count}作品 / "
+            f"{crawler.request_count}リクエスト / {format_duration(planner.elapsed())}")
+    except Exception as e:
+        log(f"エラー『{normalized_query}』: {str(e)}")
+    # 例外で中断した場合も、送信済みのリクエストは予算から差し引く
+    return crawler.request_count
+
+def run_prewarm_cycle(refresh_token, request_budget, log, window_end=None):
+    """ウォッチリストを最終取得の古い順に、リクエスト予算と時間帯の範囲内で再取得"""
+    import datetime
+    from pixivpy3 import AppPixivAPI
+    
+    api = AppPixivAPI()
+    try:
+        api.auth(refresh_token=refresh_token)  # アクセストークンは1時間で失効するので毎回認証
+    except Exception as e:
+        log(f"認証に失敗したため、今回の取得を中止します: {str(e)}")
+        return
+    
+    with IllustStore() as store:
+        entries = store.watchlist()
+    
+    remaining = request_budget
+    for entry in entries:
+        if remaining <= 0:
+            log("リクエスト予算を使い切ったため、残りのクエリは次回に回します")
+            break
+        # 時間帯の残り時間を各クエリの時間予算にして、取得中に時間帯を超えないようにする
+        time_budget_seconds = None
+        if window_end:
+            time_budget_seconds = (window_end - datetime.datetime.now()).total_seconds()
+            if time_budget_seconds <= 0:
+                log("取得時間帯が終了したため、残りのクエリは次回に回します")
+                break
+        remaining -= prewarm_query(api, entry, remaining, log, time_budget_seconds=time_budget_seconds)
+
+def run_prewarm_daemon(argv):
+    """ウォッチリストのクエリを毎日オフピーク時間帯に再取得し続ける（--onceで1回だけ実行）"""
+    import argparse
+    import datetime
+    import logging
+    
+    parser = argparse.ArgumentParser(description="ウォッチリストの事前取得デーモン")
+    parser.add_argument("--prewarm", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--refresh-token", default=os.environ.get("PIXIV_REFRESH_TOKEN"),
+                        help="Pixivのrefresh_token（環境変数PIXIV_REFRESH_TOKENでも指定可）")
+    parser.add_argument("--window", default=PREWARM_DEFAULT_WINDOW,
+                        help=f"取得を行う時間帯（時、既定: {PREWARM_DEFAULT_WINDOW}）")
+    parser.add_argument("--request-budget", type=int, default=PREWARM_DEFAULT_REQUEST_BUDGET,
+                        help=f"1回の時間帯で使う検索リクエスト数の上限（既定: {PREWARM_DEFAULT_REQUEST_BUDGET}）")
+    parser.add_argument("--once", action="store_true", help="時間帯を待たずに1回だけ取得して終了")
+    args = parser.parse_args(argv)
+    
+    if not args.refresh_token:
+        parser.error("--refresh-token または環境変数PIXIV_REFRESH_TOKENを指定してください")
+    try:
+        start_hour, end_hour = parse_hour_window(args.window)
+    except ValueError as e:
+        parser.error(str(e))
+    
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    logger = logging.getLogger("prewarm")
+    log = logger.info
+    
+    if args.once:
+        run_prewarm_cycle(args.refresh_token, args.request_budget, log)
+        return 0
+    
+    while True:
+        window_start, window_end = next_hour_window(datetime.datetime.now(), start_hour, end_hour)
+        wait_seconds = (window_start - datetime.datetime.now()).total_seconds()
+        if wait_seconds > 0:
+            log(f"次の取得時間帯 {window_start:%Y-%m-%d %H:%M} まで待機します")
+            time.sleep(wait_seconds)
+        
+        # 想定外のエラーでもデーモンを止めず、次の時間帯に再試行する
+        try:
+            run_prewarm_cycle(args.refresh_token, args.request_budget, log, window_end=window_end)
+        except Exception:
+            logger.exception("事前取得中に予期しないエラーが発生しました")
+        
+        # 同じ時間帯で再取得しないよう、時間帯の終わりまで待つ
+        wait_seconds = (window_end - datetime.datetime.now()).total_seconds()
+        if wait_seconds > 0:
+            time.sleep(wait_seconds)
 
-with col_setting2:
-    exclude_ai = st.checkbox(
-        "🤖 AI画像を除外する", 
-        value=st.session_state.get('exclude_ai', True),
-        help="チェックすると、AI関連タグを持つ作品を検索対象から除外します（タグベース判定）"
+# メインGUI
+def main():
+    st.set_page_config(
+        page_title="Pixiv タグ共起分析ツール", 
+        layout="centered",
+        initial_sidebar_state="collapsed"
     )
-    st.session_state.exclude_ai = exclude_ai
+    setup_japanese_font()
 
-# 設定状況の表示
-col_status1, col_status2 = st.columns([1, 1])
-with col_status1:
-    if exclude_english:
-        st.success("✅ 日本語タグのみ表示")
-    else:
-        st.info("ℹ️ 全言語のタグを表示")
+    st.title("🎨 Pixiv タグ共起分析ツール（検索方式選択機能付き）")
+    st.markdown("**複数タグの組み合わせで、一緒によく使われるタグを分析します**")
 
-with col_status2:
-    if exclude_ai:
-        st.success("✅ 人間作成の作品のみ")
-    else:
-        st.info("ℹ️ AI画像も含む")
-
-col1, col2 = st.columns([2, 1])
-with col1:
-    tag_query = st.text_input(
-        "検索タグ・キーワード", 
-        value="ドMホイホイ R-18",
-        help="検索方式に応じてタグまたはキーワードを入力してください。複数の場合はスペースで区切ってください。"
+    # セッション状態の初期化
+    if 'logged_in' not in st.session_state:
+        st.session_state.logged_in = False
+
+    # 使い方説明
+    with st.expander("📖 使い方と新機能（検索方式選択）"):
+        st.markdown("""
+        **🆕 新機能: 検索方式選択**:
+        - **タグ検索**: 作品に付けられたタグのみを検索（従来の方式）
+        - **キーワード検索**: タイトル・説明文も含めて検索（Pixivウェブに近い）
+        - **全文検索**: タグ・タイトル・説明文すべてを検索（最も幅広い）
+        - **タグ完全一致**: タグと完全に一致するもののみ（最も厳密）
+    
+        **🔧 修正内容**:
+        - **検索方式を選択可能に**: タグ検索とキーワード検索を選べるようになりました
+        - **クリック可能な検索リンク機能**: タグをクリックして組み合わせ検索が可能
+        - AI画像の判定を後処理で実行（タグベースでの判定）
+        - 複数タグ検索の論理を改善
+        - R18コンテンツの検索処理を最適化
+        - **詳細なデバッグ情報を追加**
+    
+        **📝 使用方法**:
+        1. **refresh_token を取得**: Pixivにログインして開発者ツールから取得
+        2. **ログイン**: 上記のトークンを入力してログインボタンを押す
+        3. **🆕 検索方式を選択**: タグ検索かキーワード検索かを選ぶ
+        4. **検索**: 複数タグの場合は `タグA タグB` の形式で入力
+        5. **分析開始**: ボタンを押して結果を待つ
+        6. **🆕 組み合わせ検索**: 結果のタグをクリックして元のタグと組み合わせ検索！
+    
+        **🔍 検索方式の違い**:
+    
+        | 検索方式 | 検索対象 | 特徴 | おすすめ用途 |
+        |----------|----------|------|-------------|
+        | **タグ検索** | タグのみ | 従来の方式、精度高い | タグの共起関係を調べたい |
+        | **キーワード検索** | タイトル・説明文 | 作品の内容を反映 | 特定のテーマ・ストーリーを探す |
+        | **全文検索** | タグ・タイトル・説明文 | 最も幅広い検索 | できるだけ多くの作品を見つけたい |
+        | **タグ完全一致** | タグ（完全一致） | 最も厳密 | 正確なタグ名で絞り込みたい |
+    
+        **🔗 新機能: クリック可能な検索リンク**:
+        - 分析結果のタグをクリックすると、自動でPixiv検索画面に移動
+        - 元の検索タグと組み合わせた検索が実行されます
+        - 例: 「おっぱい」で分析→「オリジナル」をクリック→「おっぱい オリジナル」で検索
+        - 新しいタブで開くので、分析結果を見ながら検索可能
+    
+        **🔍 デバッグ機能について**:
+        - 分析実行時に「詳細な処理状況（デバッグ情報）」が表示されます
+        - うまく動かない時は、この情報を確認してください：
+          - どのタグで検索しているか
+          - 何件の作品が見つかったか  
+          - どこでエラーが起きているか
+          - API呼び出しが成功しているか
+          - 英語タグが何件除外されたか
+          - AI画像が何件除外されたか
+          - どの検索方式を使用しているか
+    
+        **🔤 英語タグ除外機能**:
+        - 日本語（ひらがな・カタカナ・漢字）を含むタグのみを表示
+        - 「anime」「cute」「girl」などの英語タグを自動で除外
+        - より日本のPixivユーザーに関連性の高い結果が得られます
+    
+        **🤖 AI画像除外機能（修正版）**:
+        - タグベースでAI生成画像を判定・除外
+        - 「ai」「ai生成」「stable diffusion」などのタグを持つ作品を除外
+        - より人間が描いた作品に特化したタグ分析が可能
+        - API制限を回避するため後処理で判定
+    
+        **💡 検索のコツ**:
+        - **検索件数を増やしたい場合**: 「全文検索」を選択
+        - **精密なタグ関係を調べたい場合**: 「タグ検索」を選択
+        - **作品の内容重視の場合**: 「キーワード検索」を選択
+        - **⚠️ 大量取得時の注意**: 500件以上の取得には時間がかかります（15-40分程度）
+        - **サーバー負荷軽減**: 最低1.5秒間隔＋ランダムジッター＋自動リトライ機能
+        - **エラー時の自動対応**: 指数バックオフとRetry-After尊重でサーバーに優しく
+        - R18系タグは最初は少ない取得数（30-50件）で試してください
+        - 複数タグは関連性の高いものを組み合わせてください
+        - うまくいかない場合は「デバッグ情報」を確認してください
+    
+        **例**: `ドMホイホイ R-18` や `初音ミク VOCALOID` や `猫 可愛い`
+        """)
+
+    # ログインセクション
+    st.subheader("🔐 Pixivログイン")
+    refresh_token = st.text_input(
+        "Pixiv refresh_token", 
+        type="password",
+        help="Pixivの開発者ツールから取得してください"
     )
 
-with col2:
-    max_count = st.selectbox(
-        "最大取得数",
-        options=[30, 50, 100, 200, 300, 500, 750, 1000],
-        index=1,
-        help="大きな数値ほど時間がかかります。R18関連は少ない数から始めることをお勧めします"
+    col1, col2 = st.columns([1, 1])
+    with col1:
+        if st.button("🚀 ログイン", type="primary"):
+            pixiv_login(refresh_token)
+
+    with col2:
+        if st.session_state.get('logged_in', False):
+            st.success("✅ ログイン済み")
+        else:
+            st.error("❌ ログインが必要")
+
+    # 検索セクション
+    st.markdown("---")
+    st.subheader("🔍 タグ分析")
+
+    # 🆕 検索方式選択
+    st.markdown("**🆕 検索方式選択**")
+    search_mode_options = {
+        "partial_match_for_tags": "🏷️ タグ検索（部分一致）- 従来の方式",
+        "exact_match_for_tags": "🎯 タグ完全一致 - より厳密",
+        "title_and_caption": "📝 キーワード検索（タイトル・説明文）- 作品内容重視",
+        "text": "🔍 全文検索（タグ・タイトル・説明文）- 最も幅広い"
+    }
+
+    search_mode = st.selectbox(
+        "検索方式を選択してください",
+        options=list(search_mode_options.keys()),
+        format_func=lambda x: search_mode_options[x],
+        index=0,  # デフォルトはタグ検索
+        help="検索対象を選択できます。全文検索にするとPixivウェブサイトの検索に近い結果が得られます。"
     )
 
-if st.button("📊 分析開始", type="primary"):
-    if not st.session_state.get('logged_in', False):
-        st.warning("⚠️ 先にPixivへログインしてください。")
-    elif not tag_query.strip():
-        st.warning("⚠️ 検索タグ・キーワードを入力してください。")
-    else:
-        api = get_pixiv_api()
-        if api:
-            st.info(f"『{tag_query}』の分析を開始します...（検索方式: {search_mode_options[search_mode]}）")
-            results = analyze_tags(api, tag_query, max_count, search_mode)
+    # 選択した検索方式の説明を表示
+    st.info(get_search_mode_description(search_mode))
+
+    # フィルター設定
+    st.markdown("**🔧 フィルター設定**")
+    col_setting1, col_setting2 = st.columns([1, 1])
+
+    with col_setting1:
+        exclude_english = st.checkbox(
+            "🔤 英語タグを除外する", 
+            value=st.session_state.get('exclude_english', True),
+            help="チェックすると、結果から英語のタグを除外し、日本語タグのみを表示します"
+        )
+        st.session_state.exclude_english = exclude_english
+
+    with col_setting2:
+        exclude_ai = st.checkbox(
+            "🤖 AI画像を除外する", 
+            value=st.session_state.get('exclude_ai', True),
+            help="チェックすると、AI関連タグを持つ作品を検索対象から除外します（タグベース判定）"
+        )
+        st.session_state.exclude_ai = exclude_ai
+
+    # 設定状況の表示
+    col_status1, col_status2 = st.columns([1, 1])
+    with col_status1:
+        if exclude_english:
+            st.success("✅ 日本語タグのみ表示")
+        else:
+            st.info("ℹ️ 全言語のタグを表示")
+
+    with col_status2:
+        if exclude_ai:
+            st.success("✅ 人間作成の作品のみ")
+        else:
+            st.info("ℹ️ AI画像も含む")
+
+    # 予算設定（クロール計画の上限）
+    st.markdown("**⏱️ 予算設定**")
+    col_budget1, col_budget2 = st.columns([1, 1])
+
+    with col_budget1:
+        time_budget_minutes = st.number_input(
+            "時間予算（分、0で無制限）",
+            min_value=0,
+            max_value=180,
+            value=st.session_state.get('time_budget_minutes', 45),
+            step=5,
+            help="この時間内に目標件数へ届かない見込みの場合は分析を開始しません。取得中も時間内に収まるようページ数を調整します"
+        )
+        st.session_state.time_budget_minutes = time_budget_minutes
+
+    with col_budget2:
+        request_budget = st.number_input(
+            "リクエスト予算（ページ数）",
+            min_value=1,
+            max_value=MAX_SEARCH_PAGES,
+            value=st.session_state.get('request_budget', 150),
+            step=10,
+            help="1回の分析で送信する検索リクエストの上限です。AI除外などで該当率が低い場合は自動的に多めのページを取得します"
+        )
+        st.session_state.request_budget = request_budget
+
+    use_warm_data = st.checkbox(
+        f"🔥 事前取得データがあれば即時表示する（{WARM_RESULT_MAX_AGE_HOURS}時間以内のもの）",
+        value=st.session_state.get('use_warm_data', True),
+        help="同じ条件で目標件数まで取得済みのデータ（ウォッチリストや過去の分析）があれば、APIを呼ばずに取得日時付きで表示します。"
+             "チェックを外すと常に最新データを取得します"
+    )
+    st.session_state.use_warm_data = use_warm_data
+
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        tag_query = st.text_input(
+            "検索タグ・キーワード", 
+            value="ドMホイホイ R-18",
+            help="検索方式に応じてタグまたはキーワードを入力してください。複数の場合はスペースで区切ってください。"
+        )
+
+    with col2:
+        max_count = st.selectbox(
+            "最大取得数",
+            options=[30, 50, 100, 200, 300, 500, 750, 1000],
+            index=1,
+            help="大きな数値ほど時間がかかります。R18関連は少ない数から始めることをお勧めします"
+        )
+
+    if st.button("📊 分析開始", type="primary"):
+        if not st.session_state.get('logged_in', False):
+            st.warning("⚠️ 先にPixivへログインしてください。")
+        elif not tag_query.strip():
+            st.warning("⚠️ 検索タグ・キーワードを入力してください。")
+        else:
+            warm_analysis = None
+            if use_warm_data:
+                warm_analysis = load_warm_analysis(
+                    tag_query, search_mode, max_count, exclude_english, exclude_ai
+                )
             
-            if results:
-                st.success(f"✅ 分析完了！{len(results)}件のタグが見つかりました。")
-                
-                # 結果表示
-                st.subheader(f"📈 『{tag_query}』と一緒によく使われるタグ")
-                
-                # 使用した検索方式の表示
-                st.markdown(f"**使用した検索方式**: {search_mode_options[search_mode]}")
-                
-                # クリック可能なタグテーブルを表示
-                create_clickable_tag_table(results, tag_query)
-                
-                # 円グラフ表示
-                st.subheader("🥧 使用頻度グラフ")
-                plot_pie_chart(results, tag_query)
+            api = get_pixiv_api()
+            if warm_analysis:
+                st.session_state.drill_tags = []
+                st.session_state.analysis = warm_analysis
+                st.success(f"🔥 事前取得データから即時表示しました（取得日時: {format_freshness(warm_analysis['crawled_at'])}）")
+            elif api:
+                st.info(f"『{tag_query}』の分析を開始します...（検索方式: {search_mode_options[search_mode]}）")
+                tag_index = TagIndex()
+                results = analyze_tags(api, tag_query, max_count, search_mode, tag_index=tag_index)
+            
+                if results is None:
+                    pass  # 予算チェックで開始しなかった（理由は表示済み、前回の結果はそのまま表示）
+                elif results:
+                    # 前回の絞り込み選択は新しい結果に含まれないことがあるのでリセット
+                    st.session_state.drill_tags = []
+                    st.success(f"✅ 分析完了！{len(results)}件のタグが見つかりました。")
+                    # 再描画後も結果とドリルダウン用インデックスを使えるようセッションに保持
+                    st.session_state.analysis = {
+                        "query": tag_query,
+                        "search_mode": search_mode,
+                        "results": results,
+                        "tag_index": tag_index,
+                        "crawled_at": time.time()
+                    }
+                else:
+                    st.session_state.drill_tags = []
+                    st.session_state.analysis = None
+                    st.error("❌ 条件に一致するデータが見つかりませんでした。")
+                    st.info("💡 より一般的なタグや、単一のタグで試してみてください。")
+                    st.info("💡 検索方式を「全文検索」に変更すると、より多くの結果が得られる可能性があります。")
             else:
-                st.error("❌ 条件に一致するデータが見つかりませんでした。")
-                st.info("💡 より一般的なタグや、単一のタグで試してみてください。")
-                st.info("💡 検索方式を「全文検索」に変更すると、より多くの結果が得られる可能性があります。")
-        else:
-            st.error("❌ API接続に問題があります。再ログインしてください。")
+                st.error("❌ API接続に問題があります。再ログインしてください。")
+
+    # 分析結果の表示（セッションに保持した直近の結果）
+    analysis = st.session_state.get('analysis')
+    if analysis:
+        if analysis.get('partial'):
+            st.warning("⚠️ 取得が途中で中断されたため、中断時点までの暫定結果を表示しています。")
+        if analysis.get('crawled_at'):
+            st.caption(f"🕒 データ取得日時: {format_freshness(analysis['crawled_at'])}")
+        
+        # 結果表示
+        st.subheader(f"📈 『{analysis['query']}』と一緒によく使われるタグ")
+    
+        # 使用した検索方式の表示
+        st.markdown(f"**使用した検索方式**: {search_mode_options[analysis['search_mode']]}")
+    
+        # ランキング方式の選択（背景タグ頻度との比較）
+        ranking_method = st.radio(
+            "ランキング方式",
+            options=list(RANKING_METHODS.keys()),
+            format_func=lambda x: RANKING_METHODS[x],
+            horizontal=True,
+            help="リフト・TF-IDFは、これまでのクロールで蓄積した背景タグ頻度と比べて、このクエリに特徴的なタグを上位にします"
+        )
+    
+        ranked_results, ranking_scores = analysis['results'], {}
+        if ranking_method != "count":
+            tag_index = analysis['tag_index']
+            with TagBackgroundIndex() as background:
+                ranked_results, ranking_scores = rank_tags(
+                    tag_index.tag_counts(), len(tag_index), background, ranking_method
+                )
+                background_total = background.total_illusts
+            st.caption(f"背景タグ頻度インデックス: 累計{background_total}作品")
+            if background_total < len(analysis['tag_index']) * 2:
+                st.info("💡 背景データがまだ少ないため、いろいろなクエリを分析するほど精度が上がります。")
+    
+        # クリック可能なタグテーブルを表示
+        create_clickable_tag_table(
+            ranked_results,
+            analysis['query'],
+            scores=ranking_scores,
+            score_label=RANKING_SCORE_LABELS.get(ranking_method, "スコア")
+        )
+    
+        # 円グラフ表示
+        st.subheader("🥧 使用頻度グラフ")
+        plot_pie_chart(ranked_results, analysis['query'])
+    
+        # 取得済み作品からのドリルダウン分析
+        render_drill_down(analysis)
+
+    # タグトレンド追跡（差分取得）
+    st.markdown("---")
+    render_trend_tracking(tag_query, search_mode, max_count)
+
+    # ウォッチリスト（事前取得）
+    st.markdown("---")
+    render_watchlist(tag_query, search_mode, max_count)
+
+    # 保存データの並列再分析
+    st.markdown("---")
+    render_stored_reanalysis()
+
+    # フッター
+    st.markdown("---")
+    st.markdown("🛡️ **サーバー負荷軽減強化版**: 最低1.5秒間隔＋ランダムジッター＋指数バックオフ＋Retry-After尊重でPixivサーバーに優しい設計！")
 
-# フッター
-st.markdown("---")
-st.markdown("🛡️ **サーバー負荷軽減強化版**: 最低1.5秒間隔＋ランダムジッター＋指数バックオフ＋Retry-After尊重でPixivサーバーに優しい設計！")
+# Streamlit実行時のみGUIを構築（並列再分析のワーカープロセスからの読み込み時は構築しない）
+# `python pixiv_illust_analyzer.py --prewarm` で事前取得デーモンとして起動
+if __name__ == "__main__":
+    import sys
+    if "--prewarm" in sys.argv[1:]:
+        sys.exit(run_prewarm_daemon(sys.argv[1:]))
+    main()
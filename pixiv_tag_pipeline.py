@@ -0,0 +1,295 @@
+# Pixivタグ共起解析の集計パイプライン（UI非依存、並列再分析のワーカーからも利用）
+import os
+import re
+import struct
+from array import array
+from collections import Counter
+
+# タグ検索として扱う検索方式（検索タグ自体を集計から外す）
+TAG_SEARCH_MODES = ("partial_match_for_tags", "exact_match_for_tags")
+
+# AI生成作品の判定に使うタグのキーワード
+AI_KEYWORDS = ['ai', 'ai生成', 'aiイラスト', 'stable diffusion', 'midjourney', 'novel ai', 'nai']
+
+# これ未満の作品数ではプロセス起動のコストの方が大きいので単一プロセスで集計
+# （実測: 単一プロセスの集計は1作品あたり約55µs、spawnしたワーカーの起動は1プロセスあたり約0.65秒。
+#   4プロセスで約1.6万件、2プロセスで約2.4万件が損益分岐点）
+PARALLEL_MIN_ILLUSTS = 20000
+
+# 英語タグ判定と除外機能
+def is_english_tag(tag):
+    """タグが英語かどうかを判定"""
+    # 空文字や短すぎるタグは除外しない
+    if not tag or len(tag.strip()) < 2:
+        return False
+
+    tag = tag.strip()
+
+    # 日本語文字（ひらがな、カタカナ、漢字）が含まれていれば日本語タグとして扱う
+    japanese_chars = re.search(r'[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF]', tag)
+    if japanese_chars:
+        return False
+
+    # 数字のみの場合は除外しない（年号など）
+    if tag.isdigit():
+        return False
+
+    # 英語の文字が80%以上を占める場合は英語タグとして判定
+    english_chars = re.findall(r'[a-zA-Z]', tag)
+    total_meaningful_chars = re.findall(r'[a-zA-Z\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF]', tag)
+
+    if len(total_meaningful_chars) == 0:
+        return False
+
+    english_ratio = len(english_chars) / len(total_meaningful_chars)
+    return english_ratio >= 0.8
+
+def filter_tags_by_language(tags, exclude_english=True):
+    """言語設定に基づいてタグをフィルタリング"""
+    if not exclude_english:
+        return tags, 0
+
+    filtered_tags = []
+    english_count = 0
+
+    for tag in tags:
+        if is_english_tag(tag):
+            english_count += 1
+        else:
+            filtered_tags.append(tag)
+
+    return filtered_tags, english_count
+
+# AI画像判定（タグ名とAI種別のみで判定）
+def is_ai_tagged(illust_ai_type, tag_names):
+    """AI種別またはAI関連キーワードを含むタグからAI生成作品かを判定"""
+    if illust_ai_type == 2:
+        return True
+
+    for tag_name in tag_names:
+        tag_lower = tag_name.lower()
+        if any(keyword in tag_lower for keyword in AI_KEYWORDS):
+            return True
+
+    return False
+
+# 検索タグ除外（タグ検索時に検索タグ自体を集計から外す）
+def exclude_search_tags(tags, search_tags):
+    """検索タグと一致・部分一致するタグを除外"""
+    search_tags_lower = [search_tag.lower() for search_tag in search_tags]
+    filtered_tags = []
+    for tag in tags:
+        tag_lower = tag.lower()
+
+        # 検索タグと一致するかチェック
+        is_search_tag = any(
+            tag_lower == search_tag_lower or
+            search_tag_lower in tag_lower or
+            tag_lower in search_tag_lower
+            for search_tag_lower in search_tags_lower
+        )
+
+        if not is_search_tag:
+            filtered_tags.append(tag)
+
+    return filtered_tags
+
+def collect_illust_tags(illust_tags, search_tags, search_mode, exclude_english):
+    """1作品分のタグに検索タグ除外と言語フィルターを適用し、(収集タグ, 英語タグ除外数)を返す"""
+    # タグ検索の場合のみ検索タグを除外、キーワード検索の場合は除外しない
+    if search_mode in TAG_SEARCH_MODES:
+        # タグ検索：検索タグを除外した他のタグを収集
+        filtered_tags = exclude_search_tags(illust_tags, search_tags)
+    else:
+        # キーワード検索：全てのタグを収集（検索キーワードも含む）
+        filtered_tags = illust_tags
+
+    # 言語フィルターを適用
+    english_count = 0
+    if exclude_english:
+        filtered_tags, english_count = filter_tags_by_language(filtered_tags, exclude_english)
+
+    return filtered_tags, english_count
+
+# コンパクトなコーパス表現（共有メモリにそのまま載せられる連続配列）
+CORPUS_HEADER = struct.Struct("<QQQQ")  # 作品数, タグ参照数, 語彙数, 語彙バイト数
+
+class CompactCorpus:
+    """作品ごとのタグをCSR形式（オフセット＋タグID配列）で保持するコーパス
+
+    バッファ構成: ヘッダー / 作品オフセット(uint64) / 語彙オフセット(uint64) /
+    タグID(uint32) / AI種別(int8) / 語彙(UTF-8連結)
+    """
+
+    def __init__(self, offsets, vocab_offsets, tag_ids, ai_types, vocab_bytes, views=()):
+        self.offsets = offsets
+        self.vocab_offsets = vocab_offsets
+        self.tag_ids = tag_ids
+        self.ai_types = ai_types
+        self.vocab_bytes = vocab_bytes
+        self._views = list(views)
+
+    def __len__(self):
+        return len(self.ai_types)
+
+    @classmethod
+    def encode(cls, records):
+        """(作品ID, AI種別, タグ一覧)の並びからコーパスを構築"""
+        vocab = {}
+        offsets = array('Q', [0])
+        tag_ids = array('I')
+        ai_types = array('b')
+        for _, illust_ai_type, tags in records:
+            for tag in tags:
+                tag_id = vocab.get(tag)
+                if tag_id is None:
+                    tag_id = vocab[tag] = len(vocab)
+                tag_ids.append(tag_id)
+            offsets.append(len(tag_ids))
+            ai_types.append(illust_ai_type or 0)
+
+        vocab_offsets = array('Q', [0])
+        encoded_tags = []
+        for tag in vocab:
+            encoded = tag.encode('utf-8')
+            encoded_tags.append(encoded)
+            vocab_offsets.append(vocab_offsets[-1] + len(encoded))
+        return cls(offsets, vocab_offsets, tag_ids, ai_types, b"".join(encoded_tags))
+
+    @property
+    def nbytes(self):
+        return (CORPUS_HEADER.size + 8 * len(self.offsets) + 8 * len(self.vocab_offsets)
+                + 4 * len(self.tag_ids) + len(self.ai_types) + len(self.vocab_bytes))
+
+    def write_to(self, buf):
+        """共有メモリなどのバッファへ書き出す"""
+        CORPUS_HEADER.pack_into(buf, 0, len(self.ai_types), len(self.tag_ids),
+                                len(self.vocab_offsets) - 1, len(self.vocab_bytes))
+        offset = CORPUS_HEADER.size
+        for part in (self.offsets, self.vocab_offsets, self.tag_ids, self.ai_types, self.vocab_bytes):
+            data = part.tobytes() if isinstance(part, array) else part
+            buf[offset:offset + len(data)] = data
+            offset += len(data)
+
+    @classmethod
+    def from_buffer(cls, buf):
+        """バッファ上のコーパスをコピーせずに参照する"""
+        n_illusts, n_tag_refs, n_vocab, n_vocab_bytes = CORPUS_HEADER.unpack_from(buf, 0)
+        view = memoryview(buf)
+        offset = CORPUS_HEADER.size
+        sections = []
+        for size, fmt in ((8 * (n_illusts + 1), 'Q'), (8 * (n_vocab + 1), 'Q'),
+                          (4 * n_tag_refs, 'I'), (n_illusts, 'b'), (n_vocab_bytes, 'B')):
+            sections.append(view[offset:offset + size].cast(fmt))
+            offset += size
+        return cls(*sections, views=sections + [view])
+
+    def decode_vocab(self):
+        """タグIDから文字列への対応表を復元"""
+        vocab_bytes = bytes(self.vocab_bytes)
+        return [
+            vocab_bytes[self.vocab_offsets[i]:self.vocab_offsets[i + 1]].decode('utf-8')
+            for i in range(len(self.vocab_offsets) - 1)
+        ]
+
+    def release(self):
+        """バッファへの参照を解放（共有メモリを閉じる前に必要）"""
+        for view in self._views:
+            view.release()
+        self._views = []
+
+def count_corpus_range(corpus, vocab, start, end, search_tags, search_mode, exclude_ai, exclude_english):
+    """コーパスの[start, end)の作品にAI除外・検索タグ除外・言語フィルターを適用してタグを集計"""
+    counter = Counter()
+    stats = Counter()
+    offsets = corpus.offsets
+    for i in range(start, end):
+        illust_tags = [vocab[tag_id] for tag_id in corpus.tag_ids[offsets[i]:offsets[i + 1]]]
+        stats['processed'] += 1
+
+        # AI画像の除外判定
+        if exclude_ai and is_ai_tagged(corpus.ai_types[i], illust_tags):
+            stats['ai_filtered'] += 1
+            continue
+
+        filtered_tags, english_count = collect_illust_tags(illust_tags, search_tags, search_mode, exclude_english)
+        counter.update(filtered_tags)
+        stats['matched'] += 1
+        stats['english_filtered'] += english_count
+
+    return counter, stats
+
+# 並列再分析のワーカープロセス側の状態（プロセスごとに1回だけ共有メモリへ接続）
+_worker_state = {}
+
+def _detach_worker():
+    corpus = _worker_state.pop('corpus', None)
+    if corpus is not None:
+        corpus.release()
+    shm = _worker_state.pop('shm', None)
+    if shm is not None:
+        shm.close()
+
+def _init_worker(shm_name, options):
+    import atexit
+    from multiprocessing import shared_memory
+
+    # 共有メモリの解放は親プロセスが担当（リソーストラッカーは親と共有）
+    shm = shared_memory.SharedMemory(name=shm_name)
+    corpus = CompactCorpus.from_buffer(shm.buf)
+    _worker_state.update(shm=shm, corpus=corpus, vocab=corpus.decode_vocab(), options=options)
+    atexit.register(_detach_worker)
+
+def _count_shard(shard):
+    start, end = shard
+    return count_corpus_range(
+        _worker_state['corpus'], _worker_state['vocab'], start, end, **_worker_state['options']
+    )
+
+def parallel_count_tags(records, search_tags, search_mode, exclude_ai, exclude_english, workers=None):
+    """保存済み作品を共有メモリ上のコンパクト配列にしてプロセスプールで分割集計し、(タグ集計, 統計)を返す"""
+    import math
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import shared_memory
+
+    corpus = CompactCorpus.encode(records)
+    options = {
+        "search_tags": list(search_tags),
+        "search_mode": search_mode,
+        "exclude_ai": exclude_ai,
+        "exclude_english": exclude_english
+    }
+    workers = workers or os.cpu_count() or 1
+    illust_count = len(corpus)
+
+    if workers <= 1 or illust_count < PARALLEL_MIN_ILLUSTS:
+        vocab = corpus.decode_vocab()
+        counter, stats = count_corpus_range(corpus, vocab, 0, illust_count, **options)
+        stats['workers'] = 1
+        return counter, stats
+
+    # ワーカー数の数倍に分割して、シャードごとの処理時間のばらつきを均す
+    shard_size = math.ceil(illust_count / (workers * 4))
+    shards = [(start, min(start + shard_size, illust_count)) for start in range(0, illust_count, shard_size)]
+
+    shm = shared_memory.SharedMemory(create=True, size=corpus.nbytes)
+    try:
+        corpus.write_to(shm.buf)
+        total_counter = Counter()
+        total_stats = Counter()
+        # Streamlitのスレッドからforkすると不安定なため常にspawnで起動
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(shm.name, options)
+        ) as executor:
+            for counter, stats in executor.map(_count_shard, shards):
+                total_counter.update(counter)
+                total_stats.update(stats)
+        total_stats['workers'] = workers
+        return total_counter, total_stats
+    finally:
+        shm.close()
+        shm.unlink()
@@ -0,0 +1,24 @@
+import os
+import sys
+
+# リポジトリ直下のスクリプトをモジュールとして読み込めるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import functools
+
+import pytest
+
+import pixiv_illust_analyzer
+from pixiv_illust_analyzer import IllustStore, TagBackgroundIndex
+
+
+@pytest.fixture
+def store_path(tmp_path, monkeypatch):
+    """作品ストアと背景タグ頻度インデックスを一時フォルダーに置き、台帳と待機を使わずにクロールする"""
+    path = str(tmp_path / "illusts.sqlite3")
+    monkeypatch.setattr(pixiv_illust_analyzer, "IllustStore", functools.partial(IllustStore, path))
+    monkeypatch.setattr(pixiv_illust_analyzer, "TagBackgroundIndex",
+                        functools.partial(TagBackgroundIndex, str(tmp_path / "tag_background.idx")))
+    monkeypatch.setattr(pixiv_illust_analyzer, "open_rate_limit_ledger", lambda api: None)
+    monkeypatch.setattr(pixiv_illust_analyzer.time, "sleep", lambda seconds: None)
+    return path
@@ -0,0 +1,55 @@
+import threading
+
+from pixiv_illust_analyzer import TagBackgroundIndex
+
+
+def test_add_illusts_counts_each_illust_once(tmp_path):
+    path = str(tmp_path / "tag_background.idx")
+    with TagBackgroundIndex(path) as index:
+        added = index.add_illusts([(1, ["猫", "犬"]), (2, ["猫"]), (2, ["猫"]), (None, ["猫"])])
+        assert added == 2
+        assert index.total_illusts == 2
+        assert index.count("猫") == 2
+        assert index.count("犬") == 1
+        assert index.count("鳥") == 0
+
+        # 既出の作品IDは再加算しない
+        assert index.add_illusts([(1, ["猫", "犬"]), (3, ["猫", "猫"])]) == 1
+        assert index.count("猫") == 3
+        assert index.total_illusts == 3
+
+
+def test_add_illusts_merges_updates_from_other_instances(tmp_path):
+    path = str(tmp_path / "tag_background.idx")
+    with TagBackgroundIndex(path) as first, TagBackgroundIndex(path) as second:
+        first.add_illusts([(1, ["猫"])])
+        second.add_illusts([(2, ["猫"]), (1, ["猫"])])
+        assert second.total_illusts == 2
+        assert second.count("猫") == 2
+
+    with TagBackgroundIndex(path) as reopened:
+        assert reopened.total_illusts == 2
+        assert reopened.count("猫") == 2
+
+
+def test_concurrent_writers_do_not_lose_updates(tmp_path):
+    path = str(tmp_path / "tag_background.idx")
+    writers = 4
+    batches = 10
+
+    def write(worker):
+        for batch in range(batches):
+            illust_id = worker * batches + batch + 1
+            with TagBackgroundIndex(path) as index:
+                index.add_illusts([(illust_id, ["共通", f"作者{worker}"])])
+
+    threads = [threading.Thread(target=write, args=(worker,)) for worker in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with TagBackgroundIndex(path) as index:
+        assert index.total_illusts == writers * batches
+        assert index.count("共通") == writers * batches
+        assert all(index.count(f"作者{worker}") == batches for worker in range(writers))
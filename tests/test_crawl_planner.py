@@ -0,0 +1,75 @@
+import pytest
+
+import pixiv_illust_analyzer
+from pixiv_illust_analyzer import CrawlPlanner
+
+
+class FakeMonotonic:
+    def __init__(self, now=100.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def monotonic(monkeypatch):
+    clock = FakeMonotonic()
+    monkeypatch.setattr(pixiv_illust_analyzer.time, "monotonic", clock)
+    return clock
+
+
+def test_heavy_filtering_raises_the_page_budget(monotonic):
+    planner = CrawlPlanner(300, exclude_ai=False)
+    # 事前値では全作品が該当する想定なので10ページ＋余裕1ページ
+    assert planner.page_budget == 11
+
+    for _ in range(3):
+        planner.record_page(30, 3)
+    # 該当率10%の実測を事前値1ページ分と平滑化: (9 + 30) / 4 = 9.75作品/ページ
+    assert planner.page_yield == pytest.approx(9.75)
+    assert planner.remaining_pages() == 30
+    assert planner.page_budget == 3 + 30 + 1
+
+
+def test_page_budget_is_capped_by_max_requests(monotonic):
+    planner = CrawlPlanner(300, exclude_ai=False, max_requests=5)
+    planner.record_page(30, 1)
+    assert planner.page_budget == 5
+
+
+def test_time_budget_shrinks_the_page_budget_mid_crawl(monotonic):
+    planner = CrawlPlanner(300, exclude_ai=False, time_budget_seconds=60)
+    # 実測前は1ページ3秒（間隔2秒＋通信1秒）の見積もりで、時間予算は足りている
+    assert planner.page_budget == 11
+
+    # 実測で1ページ20秒かかると、残り20秒で取れるのは1ページだけ
+    monotonic.now += 40
+    planner.record_page(30, 30)
+    planner.record_page(30, 30)
+    assert planner.page_seconds == pytest.approx(20)
+    assert planner.page_budget == 3
+    assert planner.eta_seconds() == pytest.approx(20)
+
+    # 時間予算を使い切ったら、それ以上のページは取得しない
+    monotonic.now += 30
+    assert planner.page_budget == planner.pages
+
+
+def test_refuses_when_pages_needed_exceed_max_requests(monotonic):
+    planner = CrawlPlanner(1000, exclude_ai=False, max_requests=10)
+    feasible, reason = planner.check_feasibility()
+    assert not feasible
+    assert "34ページ" in reason
+    assert "10ページ" in reason
+
+    assert CrawlPlanner(300, exclude_ai=False, max_requests=10).check_feasibility() == (True, None)
+
+
+def test_refuses_when_estimated_time_exceeds_time_budget(monotonic):
+    # 10ページ × 3秒 = 30秒の見積もり
+    feasible, reason = CrawlPlanner(300, exclude_ai=False, time_budget_seconds=20).check_feasibility()
+    assert not feasible
+    assert "時間予算は0分20秒" in reason
+
+    assert CrawlPlanner(300, exclude_ai=False, time_budget_seconds=30).check_feasibility() == (True, None)
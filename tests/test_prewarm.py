@@ -0,0 +1,119 @@
+import datetime
+import json
+
+import pytest
+
+import pixiv_illust_analyzer
+from pixiv_illust_analyzer import (
+    IllustStore, load_warm_analysis, next_hour_window, parse_hour_window, prewarm_query
+)
+
+QUERY = "オリジナル"
+MODE = "partial_match_for_tags"
+
+
+class FakeResponse:
+    def __init__(self, status_code, content, reason=""):
+        self.status_code = status_code
+        self.content = content
+        self.reason = reason
+        self.headers = {}
+
+
+class PagedApi:
+    """1ページ30件の検索結果を返し、fail_from_page以降のページはHTTPエラーにする"""
+    hosts = "https://app-api.pixiv.net"
+    user_id = "user"
+
+    def __init__(self, pages=3, ai_per_page=0, fail_from_page=None):
+        self.pages = pages
+        self.ai_per_page = ai_per_page
+        self.fail_from_page = fail_from_page
+
+    def parse_qs(self, next_url):
+        return {"page": int(next_url)}
+
+    def no_auth_requests_call(self, method, url, params=None, req_auth=True):
+        page = params.get("page", 1)
+        if self.fail_from_page is not None and page >= self.fail_from_page:
+            return FakeResponse(500, b"", reason="Internal Server Error")
+        illusts = [
+            {
+                "id": page * 100 + index,
+                "illust_ai_type": 2 if index < self.ai_per_page else 1,
+                "create_date": "2026-10-01T12:00:00+09:00",
+                "tags": [{"name": QUERY}, {"name": "風景"}, {"name": f"タグ{index % 3}"}]
+            }
+            for index in range(30)
+        ]
+        next_url = str(page + 1) if page < self.pages else None
+        return FakeResponse(200, json.dumps({"illusts": illusts, "next_url": next_url}).encode())
+
+
+def watch_entry(max_illusts, exclude_ai=False):
+    return {"query": QUERY, "search_mode": MODE, "max_illusts": max_illusts,
+            "exclude_english": True, "exclude_ai": exclude_ai}
+
+
+def warm_result(path, exclude_ai=False):
+    with IllustStore(path) as store:
+        return store.load_warm_result(QUERY, MODE, True, exclude_ai), store.count_illusts()
+
+
+def test_hour_window_accepts_a_whole_day():
+    assert parse_hour_window("0-24") == (0, 24)
+    now = datetime.datetime(2026, 10, 19, 15, 30)
+    start, end = next_hour_window(now, 0, 24)
+    assert start <= now < end
+    assert end - start == datetime.timedelta(hours=24)
+
+    assert parse_hour_window("22-6") == (22, 6)
+    for window in ("5-5", "0-0", "24-3", "3-25"):
+        with pytest.raises(ValueError):
+            parse_hour_window(window)
+
+
+def test_complete_prewarm_saves_a_warm_result(store_path):
+    prewarm_query(PagedApi(), watch_entry(60), None, log=lambda message: None)
+    warm, stored = warm_result(store_path)
+    assert warm["found_count"] == 60
+    assert stored == 60
+
+
+def test_prewarm_cut_off_by_an_error_saves_no_warm_result(store_path):
+    requests = prewarm_query(PagedApi(fail_from_page=2), watch_entry(60), None, log=lambda message: None)
+    warm, stored = warm_result(store_path)
+    assert warm is None
+    # 取得できた分は再分析用に保存する
+    assert stored == 30
+    # 失敗したページのリトライも送信数に含める
+    assert requests == 1 + 4
+
+
+def test_prewarm_cut_off_by_the_request_budget_saves_no_warm_result(store_path):
+    # AI除外で該当率が下がり、1リクエストの予算では目標件数に届かない
+    entry = watch_entry(25, exclude_ai=True)
+    assert prewarm_query(PagedApi(ai_per_page=20), entry, 1, log=lambda message: None) == 1
+    warm, stored = warm_result(store_path, exclude_ai=True)
+    assert warm is None
+    assert stored == 30
+
+
+def test_warm_analysis_requires_enough_found_illusts(store_path):
+    prewarm_query(PagedApi(), watch_entry(60), None, log=lambda message: None)
+    assert load_warm_analysis(QUERY, MODE, 61, True, False) is None
+
+    analysis = load_warm_analysis(QUERY, MODE, 40, True, False)
+    assert len(analysis["tag_index"].matching_positions(["風景"])) == 40
+    assert dict(analysis["results"])["風景"] == 40
+
+
+def test_warm_analysis_ignores_old_results(store_path, monkeypatch):
+    prewarm_query(PagedApi(), watch_entry(60), None, log=lambda message: None)
+    crawled_at = warm_result(store_path)[0]["crawled_at"]
+
+    max_age = pixiv_illust_analyzer.WARM_RESULT_MAX_AGE_HOURS * 3600
+    monkeypatch.setattr(pixiv_illust_analyzer.time, "time", lambda: crawled_at + max_age - 60)
+    assert load_warm_analysis(QUERY, MODE, 60, True, False) is not None
+    monkeypatch.setattr(pixiv_illust_analyzer.time, "time", lambda: crawled_at + max_age + 60)
+    assert load_warm_analysis(QUERY, MODE, 60, True, False) is None
@@ -0,0 +1,178 @@
+import pytest
+
+import pixiv_illust_analyzer
+from pixiv_illust_analyzer import RateLimitLedger
+
+
+class FakeClock:
+    """time.time/time.sleepの代わりに使う手動で進める時計"""
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+        self.on_sleep = None
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        if self.on_sleep:
+            self.on_sleep()
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(pixiv_illust_analyzer.time, "time", clock.time)
+    monkeypatch.setattr(pixiv_illust_analyzer.time, "sleep", clock.sleep)
+    return clock
+
+
+@pytest.fixture
+def ledger_path(tmp_path):
+    return str(tmp_path / "rate_ledger.sqlite3")
+
+
+def test_reserve_allows_burst_then_spaces_requests(clock, ledger_path):
+    with RateLimitLedger("user", path=ledger_path, rate=1.0, burst=3) as ledger:
+        waits = [ledger.reserve() for _ in range(5)]
+    assert waits == [(0.0, False)] * 3 + [(1.0, False), (2.0, False)]
+
+
+def test_reservations_are_shared_between_instances(clock, ledger_path):
+    with RateLimitLedger("user", path=ledger_path, rate=2.0, burst=1) as first, \
+            RateLimitLedger("user", path=ledger_path, rate=2.0, burst=1) as second:
+        assert first.reserve() == (0.0, False)
+        assert second.reserve() == (0.5, False)
+        assert first.reserve() == (1.0, False)
+
+
+def test_accounts_have_separate_buckets(clock, ledger_path):
+    with RateLimitLedger("a", path=ledger_path, rate=1.0, burst=1) as a, \
+            RateLimitLedger("b", path=ledger_path, rate=1.0, burst=1) as b:
+        assert a.reserve() == (0.0, False)
+        a.block(30)
+        assert b.reserve() == (0.0, False)
+
+
+def test_block_stops_reservations_and_refills_only_after_it_ends(clock, ledger_path):
+    with RateLimitLedger("user", path=ledger_path, rate=1.0, burst=3) as ledger:
+        ledger.block(6.0)
+        clock.now += 2.0
+        assert ledger.reserve() == (4.0, True)
+
+        # 停止明けにバースト分を一斉送信しない
+        clock.now += 4.0
+        assert [ledger.reserve() for _ in range(3)] == [(1.0, False), (2.0, False), (3.0, False)]
+
+
+def test_block_does_not_shorten_a_longer_block(clock, ledger_path):
+    with RateLimitLedger("user", path=ledger_path, rate=1.0, burst=1) as ledger:
+        ledger.block(30.0)
+        ledger.block(5.0)
+        assert ledger.blocked_until() == clock.now + 30.0
+
+
+def test_acquire_waits_out_a_block_raised_during_a_reserved_wait(clock, ledger_path):
+    with RateLimitLedger("user", path=ledger_path, rate=1.0, burst=1) as ledger, \
+            RateLimitLedger("user", path=ledger_path, rate=1.0, burst=1) as other:
+        start = clock.now
+        ledger.reserve()
+
+        # 予約した枠を待っている間に、別プロセスがレート制限を検出する
+        def block_once():
+            clock.on_sleep = None
+            other.block(30.0)
+
+        clock.on_sleep = block_once
+        notices = []
+        ledger.acquire(notify=notices.append)
+        assert clock.now >= start + 30.0
+        assert notices
+
+
+class FakeResponse:
+    def __init__(self, status_code, content, reason="", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.reason = reason
+        self.headers = headers or {}
+
+
+class FakeApi:
+    hosts = "https://app-api.pixiv.net"
+    user_id = "user"
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def no_auth_requests_call(self, method, url, params=None, req_auth=True):
+        self.calls += 1
+        return self.responses.pop(0)
+
+
+def test_rate_limit_error_body_blocks_the_whole_account(clock, ledger_path):
+    api = FakeApi([
+        FakeResponse(403, b'{"error": {"message": "Rate Limit"}}', reason="Forbidden"),
+        FakeResponse(200, b'{"illusts": [], "next_url": null}'),
+    ])
+    with RateLimitLedger("user", path=ledger_path) as ledger:
+        start = clock.now
+        result, error = pixiv_illust_analyzer.exponential_backoff_request(
+            api, lambda: pixiv_illust_analyzer.lean_search_illust(api, {}),
+            notify=lambda message: None, ledger=ledger
+        )
+        assert error is None
+        assert api.calls == 2
+        # レート制限として全プロセス共通で30秒以上停止してからリトライする
+        assert clock.now >= start + 30
+        assert ledger.blocked_until() >= start + 30
+
+
+def test_rate_limit_on_the_last_attempt_is_still_shared(clock, ledger_path):
+    api = FakeApi([FakeResponse(403, b'{"error": {"message": "Rate Limit"}}', reason="Forbidden")])
+    with RateLimitLedger("user", path=ledger_path) as ledger:
+        start = clock.now
+        result, error = pixiv_illust_analyzer.exponential_backoff_request(
+            api, lambda: pixiv_illust_analyzer.lean_search_illust(api, {}),
+            max_retries=0, notify=lambda message: None, ledger=ledger
+        )
+        assert result is None
+        assert "Rate Limit" in error
+        assert api.calls == 1
+        # リトライしなくても、他のプロセスが停止明けまで待つよう台帳に記録する
+        assert ledger.blocked_until() >= start + 30
+
+
+def test_retry_after_on_the_last_attempt_is_still_shared(clock, ledger_path):
+    api = FakeApi([FakeResponse(503, b"", reason="Service Unavailable", headers={"Retry-After": "120"})])
+    with RateLimitLedger("user", path=ledger_path) as ledger:
+        start = clock.now
+        result, error = pixiv_illust_analyzer.exponential_backoff_request(
+            api, lambda: pixiv_illust_analyzer.lean_search_illust(api, {}),
+            max_retries=0, notify=lambda message: None, ledger=ledger
+        )
+        assert error is not None
+        assert ledger.blocked_until() >= start + 120
+
+
+def test_bad_request_with_error_body_ends_without_retry(clock, ledger_path):
+    api = FakeApi([FakeResponse(400, b'{"error": {"message": "offset must be no more than 5000"}}')])
+    with RateLimitLedger("user", path=ledger_path) as ledger:
+        result, error = pixiv_illust_analyzer.exponential_backoff_request(
+            api, lambda: pixiv_illust_analyzer.lean_search_illust(api, {}),
+            notify=lambda message: None, ledger=ledger
+        )
+    assert error is None
+    assert api.calls == 1
+    assert result.illusts == []
+    assert "offset" in result.error
+
+
+def test_unwritable_ledger_falls_back_to_per_process_pacing(tmp_path, monkeypatch):
+    blocker = tmp_path / "not_a_directory"
+    blocker.write_text("")
+    monkeypatch.setattr(pixiv_illust_analyzer, "RateLimitLedger",
+                        lambda account: RateLimitLedger(account, path=str(blocker / "rate_ledger.sqlite3")))
+    assert pixiv_illust_analyzer.open_rate_limit_ledger(FakeApi([])) is None
@@ -0,0 +1,44 @@
+from pixiv_illust_analyzer import TagIndex
+
+
+def build_index():
+    index = TagIndex()
+    index.add(10, ["猫", "犬", "Bx"])
+    index.add(11, ["猫", "B", "Bx", "空"])
+    index.add(12, ["犬", "B"])
+    index.add(13, ["猫", "犬", "B", "空", "空"])
+    return index
+
+
+def test_matching_positions_intersects_all_tags():
+    index = build_index()
+    assert index.matching_positions(["猫"]) == [0, 1, 3]
+    assert index.matching_positions(["猫", "犬"]) == [0, 3]
+    assert index.matching_positions(["犬", "猫", "B"]) == [3]
+    # 同じ作品に重複したタグは1回だけ登録する
+    assert list(index.postings["空"]) == [1, 3]
+
+
+def test_matching_positions_is_empty_for_a_missing_tag():
+    index = build_index()
+    assert index.matching_positions(["猫", "鳥"]) == []
+    assert index.matching_positions([]) == []
+    assert index.drill_down(["鳥"]) == (0, [])
+
+
+def test_drill_down_excludes_search_tags_by_substring_in_tag_search_modes():
+    index = build_index()
+    count, top_tags = index.drill_down(["B"], search_mode="partial_match_for_tags")
+    assert count == 3
+    # 親クエリの集計と同じ部分一致の規則なので、「Bx」も除外される
+    assert dict(top_tags) == {"犬": 2, "猫": 2, "空": 3}
+
+    count, top_tags = index.drill_down(["B"], search_mode="exact_match_for_tags")
+    assert "Bx" not in dict(top_tags)
+
+
+def test_drill_down_excludes_only_exact_tags_in_keyword_search():
+    index = build_index()
+    count, top_tags = index.drill_down(["B"], search_mode="title_and_caption")
+    assert count == 3
+    assert dict(top_tags) == {"犬": 2, "猫": 2, "空": 3, "Bx": 1}
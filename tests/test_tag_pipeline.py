@@ -0,0 +1,85 @@
+import random
+from collections import Counter
+from multiprocessing import shared_memory
+
+import pixiv_tag_pipeline
+from pixiv_tag_pipeline import (
+    CompactCorpus,
+    collect_illust_tags,
+    count_corpus_range,
+    is_ai_tagged,
+    parallel_count_tags,
+)
+
+RECORDS = [
+    (1, 0, ["猫", "オリジナル", "cat"]),
+    (2, 2, ["猫", "犬"]),
+    (3, 1, []),
+    (4, None, ["犬", "AIイラスト", "オリジナル"]),
+    (5, 1, ["猫耳", "女の子", "original"]),
+]
+
+
+def make_records(count, seed=0):
+    rng = random.Random(seed)
+    vocab = [f"タグ{i}" for i in range(300)] + [f"tag{i}" for i in range(100)] + ["猫", "猫耳", "AI生成"]
+    return [(i, rng.choice([0, 1, 2]), rng.sample(vocab, rng.randint(0, 12))) for i in range(count)]
+
+
+def reference_count(records, search_tags, search_mode, exclude_ai, exclude_english):
+    counter = Counter()
+    for _, ai_type, tags in records:
+        if exclude_ai and is_ai_tagged(ai_type, tags):
+            continue
+        counter.update(collect_illust_tags(tags, search_tags, search_mode, exclude_english)[0])
+    return counter
+
+
+def test_compact_corpus_round_trips_through_shared_memory():
+    corpus = CompactCorpus.encode(RECORDS)
+    shm = shared_memory.SharedMemory(create=True, size=corpus.nbytes)
+    try:
+        corpus.write_to(shm.buf)
+        attached = CompactCorpus.from_buffer(shm.buf)
+        try:
+            vocab = attached.decode_vocab()
+            assert len(attached) == len(RECORDS)
+            for i, (_, ai_type, tags) in enumerate(RECORDS):
+                start, end = attached.offsets[i], attached.offsets[i + 1]
+                assert [vocab[tag_id] for tag_id in attached.tag_ids[start:end]] == tags
+                assert attached.ai_types[i] == (ai_type or 0)
+        finally:
+            attached.release()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def test_count_corpus_range_matches_per_illust_pipeline():
+    records = make_records(500)
+    corpus = CompactCorpus.encode(records)
+    vocab = corpus.decode_vocab()
+    for search_mode in ("partial_match_for_tags", "text"):
+        counter, stats = count_corpus_range(corpus, vocab, 0, len(corpus), ["猫"], search_mode, True, True)
+        assert counter == reference_count(records, ["猫"], search_mode, True, True)
+        assert stats['processed'] == len(records)
+        assert stats['matched'] + stats['ai_filtered'] == len(records)
+
+
+def test_parallel_count_matches_serial(monkeypatch):
+    records = make_records(2000)
+    serial_counter, serial_stats = parallel_count_tags(
+        records, ["猫"], "partial_match_for_tags", True, True, workers=1
+    )
+
+    # 小さなデータでもプロセスプールを使わせる
+    monkeypatch.setattr(pixiv_tag_pipeline, "PARALLEL_MIN_ILLUSTS", 0)
+    parallel_counter, parallel_stats = parallel_count_tags(
+        records, ["猫"], "partial_match_for_tags", True, True, workers=2
+    )
+
+    assert parallel_stats['workers'] == 2
+    assert serial_stats['workers'] == 1
+    assert parallel_counter == serial_counter
+    for key in ("processed", "matched", "ai_filtered", "english_filtered"):
+        assert parallel_stats[key] == serial_stats[key]
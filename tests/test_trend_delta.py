@@ -0,0 +1,108 @@
+import datetime
+import json
+from urllib.parse import parse_qsl
+
+from pixiv_illust_analyzer import IllustStore, crawl_trend_delta
+
+QUERY = "オリジナル"
+MODE = "partial_match_for_tags"
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, content):
+        self.content = content
+
+
+class DateSortedApi:
+    """新着順（ID降順）の検索結果を1ページ30件で返し、end_dateでの絞り込みに対応する"""
+    hosts = "https://app-api.pixiv.net"
+    user_id = "user"
+
+    def __init__(self):
+        self.illusts = []
+
+    def post(self, first_id, last_id):
+        for illust_id in range(first_id, last_id + 1):
+            day = datetime.date(2026, 1, 1) + datetime.timedelta(days=illust_id // 10)
+            self.illusts.append({
+                "id": illust_id,
+                "illust_ai_type": 1,
+                "create_date": f"{day.isoformat()}T12:00:00+09:00",
+                "tags": [{"name": QUERY}, {"name": f"タグ{illust_id}"}]
+            })
+
+    def parse_qs(self, next_url):
+        return dict(parse_qsl(next_url))
+
+    def no_auth_requests_call(self, method, url, params=None, req_auth=True):
+        offset = int(params.get("offset", 0))
+        end_date = params.get("end_date")
+        matched = sorted(
+            (illust for illust in self.illusts if not end_date or illust["create_date"][:10] <= end_date),
+            key=lambda illust: illust["id"], reverse=True
+        )
+        page = matched[offset:offset + 30]
+        next_url = None
+        if offset + 30 < len(matched):
+            next_url = "&".join(f"{key}={value}" for key, value in {**params, "offset": offset + 30}.items())
+        return FakeResponse(json.dumps({"illusts": page, "next_url": next_url}).encode())
+
+
+def run_delta(api, baseline_illusts=30, request_budget=None):
+    return crawl_trend_delta(api, QUERY, MODE, True, True, baseline_illusts,
+                             log=lambda message: None, request_budget=request_budget)
+
+
+def counted_ids(path):
+    with IllustStore(path) as store:
+        _, bucket_tags = store.trend_series(QUERY, MODE, True, True)
+    return sorted(
+        int(tag[len("タグ"):]) for tag_counter in bucket_tags.values() for tag, count in tag_counter.items()
+        for _ in range(count)
+    )
+
+
+def test_delta_resumes_the_gap_before_advancing_the_watermark(store_path):
+    api = DateSortedApi()
+    api.post(1, 100)
+    summary = run_delta(api)
+    assert summary["first_run"] and not summary["gap_remaining"]
+    assert counted_ids(store_path) == list(range(71, 101))
+
+    # 予算切れで前回の最新作品まで届かなければ、最新作品の位置は据え置いて続きの位置を記録する
+    api.post(101, 190)
+    summary = run_delta(api, request_budget=1)
+    assert summary["gap_remaining"]
+    with IllustStore(store_path) as store:
+        state = store.trend_state(QUERY, MODE, True, True)
+    assert state["newest_illust_id"] == 100
+    assert state["pending_newest_id"] == 190
+    assert state["resume_before_id"] == 161
+
+    # 途中で新着が増えても、続きから前回の最新作品まで遡ってから位置を進める
+    api.post(191, 200)
+    assert run_delta(api, request_budget=1)["gap_remaining"]
+    summary = run_delta(api)
+    assert not summary["gap_remaining"]
+    with IllustStore(store_path) as store:
+        state = store.trend_state(QUERY, MODE, True, True)
+    assert state == {"newest_illust_id": 190, "pending_newest_id": None, "resume_before_id": None,
+                     "resume_date": None}
+    assert counted_ids(store_path) == list(range(71, 191))
+
+    # 次の通常の差分取得で、続きの取得中に増えた分を拾う
+    run_delta(api)
+    assert counted_ids(store_path) == list(range(71, 201))
+
+
+def test_delta_is_not_capped_by_the_baseline_size(store_path):
+    api = DateSortedApi()
+    api.post(1, 30)
+    run_delta(api)
+    api.post(31, 130)
+    summary = run_delta(api)
+    assert summary["new_illusts"] == 100
+    assert not summary["gap_remaining"]
+    assert counted_ids(store_path) == list(range(1, 131))